@@ -1,9 +1,643 @@
+import argparse
+import multiprocessing
+import os
+import queue
 import random
+import threading
+import time
+from ChessEngine import MoveCache
 
 
 # Random mode, when you make a move the opponent chooses a random move from the valid moves and makes that move
 # Performance: pretty bad
-def RandomBot(moves):
+def RandomBot(moves, state=None):
 
     return random.randint(0, len(moves) - 1)
 
+
+PIECE_VALUES = {'P': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+MATE = 100000
+MATE_BOUND = MATE - 1000  # scores above this are mates, stored in the table relative to the node
+DELTA_MARGIN = 200  # a capture is skipped in quiescence when even winning its victim plus this can't reach alpha
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+# Tapered material and piece-square score from the side to move's point of view, kept up to date by makeMove
+def evaluate(state):
+    return state.evaluation()
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+# Fixed size transposition table. Each slot holds (key, depth, score, bound, best move code, generation); a slot is
+# overwritten when the new entry is at least as deep, or when the stored one comes from an earlier search.
+class TranspositionTable:
+    def __init__(self, size=1 << 18):
+        self.size = size
+        self.slots = [None] * size
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    def newSearch(self):
+        self.generation += 1
+        self.probes = 0
+        self.hits = 0
+
+    def probe(self, key):
+        self.probes += 1
+        entry = self.slots[key % self.size]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, bestMove):
+        index = key % self.size
+        entry = self.slots[index]
+        if entry is None or entry[0] == key or depth >= entry[1] or entry[5] != self.generation:
+            self.slots[index] = (key, depth, score, bound, bestMove, self.generation)
+
+    # Like probe, but without counting towards the hit rate
+    def peek(self, key):
+        entry = self.slots[key % self.size]
+        return entry if entry is not None and entry[0] == key else None
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+
+# Hit rate of a move cache since its (hits, misses) were taken at the start of a search, None without a cache
+def cacheHitRate(cache, start):
+    if cache is None:
+        return None
+    hits, lookups = cache.hits - start[0], cache.hits + cache.misses - start[0] - start[1]
+    return hits / lookups if lookups else 0.0
+
+
+# Plays from an opening book (Book.OpeningBook) when the position is in it, filling in the bot's stats and pv
+def bookMove(bot, state, moves):
+    if bot.book is None:
+        return None
+    move = bot.book.choose(state, moves)
+    if move is not None:
+        bot.pv = [move]
+        bot.stats = {"depth": 0, "nodes": 0, "time": 0.0, "nps": 0.0, "score": 0, "pv": [move.getNotation()],
+                     "book": True}
+    return move
+
+
+# Negamax alpha-beta with iterative deepening and a transposition table. Called like RandomBot, with the valid
+# moves and the state they belong to, and returns the index of the chosen move. Stops at maxDepth, after timeLimit
+# seconds or after nodeLimit nodes, whichever comes first, and keeps the best move of the last finished iteration.
+# With a book, book moves are played without searching, and with tablebases (Tablebase.Tablebases) positions they
+# cover are scored exactly instead of being searched.
+class AlphaBetaBot:
+    def __init__(self, maxDepth=64, timeLimit=1.0, nodeLimit=None, tableSize=1 << 18, verbose=False, book=None,
+                 tablebases=None, quiescence=True, moveCacheSize=0):
+        self.maxDepth = maxDepth
+        self.timeLimit = timeLimit
+        self.nodeLimit = nodeLimit
+        self.table = TranspositionTable(tableSize)
+        self.verbose = verbose
+        self.book = book
+        self.tablebases = tablebases
+        self.quiescence = quiescence
+        self.moveCache = MoveCache(moveCacheSize) if moveCacheSize else None  # shared by every state it searches
+        self.stats = {}
+        self.nodes = 0
+        self.quiescenceNodes = 0
+        self.deadline = None
+        self.pv = []
+        self.stopRequested = False  # set from another thread to end the current search early
+        self.pondering = False  # while set the time limit is ignored, until ponderhit
+        self.info = None  # called as info(depth, score, seconds) after every finished iteration, self.pv is its line
+        self.searchStart = time.perf_counter()
+
+    def __call__(self, moves, state):
+        move, score = self.search(state, moves)
+        return moves.index(move)
+
+    # The bot's move cache serves the state only while it is being searched, the caller's state keeps its own after
+    def search(self, state, moves=None):
+        if self.moveCache is None:
+            return self.searchPosition(state, moves)
+        own = 'moveCache' in vars(state)
+        previous = state.moveCache
+        state.moveCache = self.moveCache
+        try:
+            return self.searchPosition(state, moves)
+        finally:
+            if own:
+                state.moveCache = previous
+            else:
+                del state.moveCache
+
+    def searchPosition(self, state, moves):
+        if moves is None:
+            moves = state.getValidMoves()
+        move = bookMove(self, state, moves)
+        if move is not None:
+            return move, 0
+        self.table.newSearch()
+        self.nodes = 0
+        self.quiescenceNodes = 0
+        cacheLookups = (self.moveCache.hits, self.moveCache.misses) if self.moveCache is not None else None
+        start = self.searchStart = time.perf_counter()
+        self.deadline = start + self.timeLimit if self.timeLimit else None
+        bestMove = moves[0]
+        bestScore = 0
+        depthReached = 0
+        for depth in range(1, self.maxDepth + 1):
+            try:
+                score, move = self.root(state, moves, depth)
+            except SearchTimeout:
+                break
+            bestMove, bestScore, depthReached = move, score, depth
+            self.pv = self.principalVariation(state, depth)
+            if self.verbose:
+                self.report(depth, score, start)
+            if self.info is not None:
+                self.info(depth, score, time.perf_counter() - start)
+            if abs(score) > MATE_BOUND or len(moves) == 1:
+                break
+        elapsed = time.perf_counter() - start
+        self.stats = {"depth": depthReached, "nodes": self.nodes, "quiescenceNodes": self.quiescenceNodes,
+                      "time": elapsed,
+                      "nps": self.nodes / elapsed if elapsed > 0 else 0.0, "ttHitRate": self.table.hitRate(),
+                      "moveCacheHitRate": cacheHitRate(self.moveCache, cacheLookups),
+                      "score": bestScore, "pv": [m.getNotation() for m in self.pv]}
+        return bestMove, bestScore
+
+    def root(self, state, moves, depth):
+        alpha, beta = -MATE - 1, MATE + 1
+        bestMove = None
+        entry = self.table.probe(state.zobristKey)
+        for move in self.orderMoves(moves, entry[4] if entry is not None else None):
+            state.makeMove(move)
+            try:
+                score = -self.negamax(state, depth - 1, -beta, -alpha, 1)
+            finally:
+                state.undoMove()
+            if bestMove is None or score > alpha:
+                alpha = score
+                bestMove = move
+        self.table.store(state.zobristKey, depth, alpha, EXACT, bestMove.code)
+        return alpha, bestMove
+
+    def negamax(self, state, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkBudget()
+        if self.tablebases is not None:
+            found = self.tablebases.probe(state)
+            if found is not None:
+                result, plies = found
+                return result * (MATE - ply - plies)
+        if depth <= 0:
+            if self.quiescence:
+                return self.quiescenceSearch(state, alpha, beta, ply)
+            return self.evaluate(state)
+        key = state.zobristKey
+        originalAlpha = alpha
+        hashMove = None
+        entry = self.table.probe(key)
+        if entry is not None:
+            hashMove = entry[4]
+            if entry[1] >= depth:
+                score = self.fromTable(entry[2], ply)
+                if entry[3] == EXACT:
+                    return score
+                if entry[3] == LOWER and score >= beta:
+                    return score
+                if entry[3] == UPPER and score <= alpha:
+                    return score
+
+        # Moves come in stages (hash move, captures, quiet moves), so a cutoff skips generating the later ones
+        bestScore = -MATE - 1
+        bestMove = None
+        for move in state.getStagedMoves(hashMove):
+            state.makeMove(move)
+            try:
+                score = -self.negamax(state, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                state.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        if bestMove is None:
+            return -MATE + ply if state.inCheck else 0
+
+        if bestScore <= originalAlpha:
+            bound = UPPER
+        elif bestScore >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table.store(key, depth, self.toTable(bestScore, ply), bound, bestMove.code)
+        return bestScore
+
+    # Captures and promotions only, until the position is quiet. The side to move may stand pat on the static
+    # evaluation instead of capturing; captures that can't lift the score to alpha even with a margin (delta pruning)
+    # or that lose material by static exchange evaluation are skipped without being played. In check every evasion is
+    # searched and there is no standing pat.
+    def quiescenceSearch(self, state, alpha, beta, ply):
+        self.nodes += 1
+        self.quiescenceNodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkBudget()
+        moves = state.getTacticalMoves()
+        inCheck = state.inCheck
+        if inCheck:
+            if len(moves) == 0:
+                return -MATE + ply
+            standPat = bestScore = -MATE - 1
+        else:
+            standPat = bestScore = self.evaluate(state)
+            if bestScore >= beta:
+                return bestScore
+            alpha = max(alpha, bestScore)
+        for move in moves:
+            if not inCheck:
+                gain = PIECE_VALUES[move.pieceCaptured[1]] if move.pieceCaptured != '--' else 0
+                if move.isPawnPromotion:
+                    gain += PIECE_VALUES['Q'] - PIECE_VALUES['P']
+                if standPat + gain + DELTA_MARGIN <= alpha:
+                    continue
+                if move.pieceCaptured != '--' and state.see(move) < 0:
+                    continue
+            state.makeMove(move)
+            try:
+                score = -self.quiescenceSearch(state, -beta, -alpha, ply + 1)
+            finally:
+                state.undoMove()
+            if score > bestScore:
+                bestScore = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return bestScore
+
+    def evaluate(self, state):
+        return evaluate(state)
+
+    # Hash (principal variation) move first, then captures by most valuable victim / least valuable attacker
+    @staticmethod
+    def orderMoves(moves, hashMove):
+        def priority(move):
+            if move.code == hashMove:
+                return -1000000
+            if move.pieceCaptured != '--':
+                return -(PIECE_VALUES[move.pieceCaptured[1]] * 10 - PIECE_VALUES[move.pieceMoved[1]] // 10)
+            return 0
+        return sorted(moves, key=priority)
+
+    def checkBudget(self):
+        if self.stopRequested:
+            raise SearchTimeout()
+        if self.deadline is not None and not self.pondering and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchTimeout()
+
+    def stop(self):
+        self.stopRequested = True
+
+    # The move that was pondered on was played. The time spent pondering counts, so a search that has already used
+    # its time limit returns the move from its last finished iteration right away.
+    def ponderhit(self):
+        self.deadline = self.searchStart + self.timeLimit if self.timeLimit else None
+        self.pondering = False
+
+    # Walks the table's best moves from the root to recover the line the search expects
+    def principalVariation(self, state, depth):
+        line = []
+        for _ in range(depth):
+            entry = self.table.peek(state.zobristKey)
+            if entry is None:
+                break
+            move = next((m for m in state.getValidMoves() if m.code == entry[4]), None)
+            if move is None:
+                break
+            line.append(move)
+            state.makeMove(move)
+        for _ in line:
+            state.undoMove()
+        return line
+
+    def report(self, depth, score, start):
+        elapsed = time.perf_counter() - start
+        print("depth %d  score %d  nodes %d  nps %.0f  tt hits %.1f%%  pv %s" %
+              (depth, score, self.nodes, self.nodes / elapsed if elapsed > 0 else 0.0, 100 * self.table.hitRate(),
+               " ".join(m.getNotation() for m in self.pv)))
+
+    # Mate scores are stored relative to the node so they stay correct when reached through another path
+    @staticmethod
+    def toTable(score, ply):
+        if score > MATE_BOUND:
+            return score + ply
+        if score < -MATE_BOUND:
+            return score - ply
+        return score
+
+    @staticmethod
+    def fromTable(score, ply):
+        if score > MATE_BOUND:
+            return score - ply
+        if score < -MATE_BOUND:
+            return score + ply
+        return score
+
+
+# AlphaBetaBot scoring positions with an NNUE network (NNUE.py): a network file, an NNUENetwork or None for the
+# piece-square network. The accumulator is reset at the root of every search and kept in step with the moves made.
+class NNUEBot(AlphaBetaBot):
+    def __init__(self, network=None, **kwargs):
+        super().__init__(**kwargs)
+        from NNUE import NNUENetwork, Accumulator, psqtNetwork  # numpy is only needed by this bot
+        if network is None:
+            network = psqtNetwork()
+        elif isinstance(network, str):
+            network = NNUENetwork.load(network)
+        self.accumulator = Accumulator(network)
+
+    def search(self, state, moves=None):
+        self.accumulator.reset(state)
+        return super().search(state, moves)
+
+    def evaluate(self, state):
+        return self.accumulator.evaluate(state)
+
+
+# Runs a bot on its own thread so the caller (the pygame loop) keeps drawing while it thinks. think() starts a search
+# on a clone of the position, poll() returns the chosen move's index once it is ready and cancel() abandons it.
+# With ponder=True and a bot that supports it (AlphaBetaBot), the bot keeps searching the position after the reply
+# it expects while the opponent thinks, and when that reply is played the running search simply continues.
+class SearchThread:
+    def __init__(self, bot, ponder=False):
+        self.bot = bot
+        self.ponder = ponder and hasattr(bot, "ponderhit")
+        self.thread = None
+        self.result = None
+        self.error = None  # what the search raised, poll() raises it again on the caller's thread
+        self.ponderMove = None  # code of the predicted reply being pondered on
+
+    def think(self, state):
+        if self.ponderMove is not None and state.moveLog and state.moveLog[-1].code == self.ponderMove:
+            self.ponderMove = None
+            self.bot.ponderhit()
+            return
+        self.cancel()
+        self.launch(state.clone())
+
+    # Starts pondering after the bot's own move has been played on state
+    def startPondering(self, state):
+        self.cancel()
+        if not self.ponder or len(self.bot.pv) < 2:
+            return
+        position = state.clone()
+        expected = next((m for m in position.getValidMoves() if m.code == self.bot.pv[1].code), None)
+        if expected is None:
+            return
+        position.makeMove(expected)
+        self.ponderMove = expected.code
+        self.bot.pondering = True
+        self.launch(position)
+
+    def launch(self, state):
+        self.result = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, args=(state,), daemon=True)
+        self.thread.start()
+
+    def run(self, state):
+        try:
+            moves = state.getValidMoves()
+            if len(moves) == 0:
+                return
+            if hasattr(self.bot, "search"):
+                move, score = self.bot.search(state, moves)
+            else:
+                move = moves[self.bot(moves, state)]
+            self.result = move.code
+        except Exception as error:
+            self.error = error
+
+    def thinking(self):
+        return self.thread is not None and self.ponderMove is None
+
+    # Index of the bot's move in moves when the search is done, otherwise None. Raises what the search raised, so a
+    # failed search doesn't leave the caller waiting for a move forever.
+    def poll(self, moves):
+        if not self.thinking() or self.thread.is_alive():
+            return None
+        self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        if self.result is None:
+            return None
+        return next((i for i, m in enumerate(moves) if m.code == self.result), None)
+
+    def cancel(self):
+        if self.thread is not None:
+            if hasattr(self.bot, "stop"):
+                self.bot.stop()
+            self.thread.join()
+            self.thread = None
+        if hasattr(self.bot, "stop"):
+            self.bot.stopRequested = False
+            self.bot.pondering = False
+        self.ponderMove = None
+        self.result = None
+        self.error = None
+
+
+# Root split parallel search. Every iteration searches the first (best so far) root move in one worker, then all the
+# other root moves at once across the pool with the first move's score as alpha, and merges the results. Each
+# process keeps its own AlphaBetaBot, so its transposition table carries over between iterations and searches.
+class ParallelBot:
+    def __init__(self, workers=None, maxDepth=64, timeLimit=1.0, nodeLimit=None, tableSize=1 << 18, verbose=False,
+                 book=None, tablebases=None):
+        self.workers = workers or os.cpu_count()
+        self.maxDepth = maxDepth
+        self.timeLimit = timeLimit
+        self.nodeLimit = nodeLimit
+        self.tableSize = tableSize
+        self.verbose = verbose
+        self.book = book
+        self.tablebases = tablebases  # the pool processes open their own copy of the same directory
+        self.pool = None
+        self.stats = {}
+        self.pv = []
+
+    def __call__(self, moves, state):
+        move, score = self.search(state, moves)
+        return moves.index(move)
+
+    def search(self, state, moves=None):
+        if moves is None:
+            moves = state.getValidMoves()
+        move = bookMove(self, state, moves)
+        if move is not None:
+            return move, 0
+        if self.pool is None:
+            directory = self.tablebases.directory if self.tablebases is not None else None
+            self.pool = multiprocessing.Pool(self.workers, initWorker, (self.tableSize, directory))
+        position = (type(state), state.toBytes())
+        start = time.perf_counter()
+        deadline = time.time() + self.timeLimit if self.timeLimit else None
+        order = list(moves)
+        bestMove, bestScore, depthReached, nodes = order[0], 0, 0, 0
+        for depth in range(1, self.maxDepth + 1):
+            [first], nodes = self.searchMoves([(position, order[0].code, depth, -MATE - 1, deadline)], nodes)
+            if first[1] is None:
+                break
+            tasks = [(position, move.code, depth, first[1], deadline) for move in order[1:]]
+            results, nodes = self.searchMoves(tasks, nodes)
+            results = [first] + results
+            if any(result is None or result[1] is None for result in results):
+                break
+            scores = {code: score for code, score, _, _ in results}
+            line = max(results, key=lambda result: result[1])
+            order.sort(key=lambda move: -scores[move.code])
+            bestMove, bestScore, depthReached = order[0], line[1], depth
+            self.pv = replayLine(state, [line[0]] + line[3])
+            if self.verbose:
+                elapsed = time.perf_counter() - start
+                print("depth %d  score %d  nodes %d  nps %.0f  pv %s" % (depth, bestScore, nodes,
+                      nodes / elapsed if elapsed > 0 else 0.0, " ".join(m.getNotation() for m in self.pv)))
+            if abs(bestScore) > MATE_BOUND or len(moves) == 1:
+                break
+        elapsed = time.perf_counter() - start
+        self.stats = {"depth": depthReached, "nodes": nodes, "time": elapsed,
+                      "nps": nodes / elapsed if elapsed > 0 else 0.0, "workers": self.workers, "score": bestScore,
+                      "pv": [m.getNotation() for m in self.pv]}
+        return bestMove, bestScore
+
+    # Runs root move searches across the pool, at most one per worker at a time, and returns their results and the
+    # node count with theirs added. nodeLimit bounds the whole search like AlphaBetaBot's: every search reserves an
+    # equal share of the nodes neither used nor reserved when it starts and hands back what it didn't use. After a
+    # search runs out of time or nodes the rest aren't started, their results stay None.
+    def searchMoves(self, tasks, nodes):
+        results = [None] * len(tasks)
+        finished = queue.Queue()
+        running = {}  # task index -> nodes reserved for it
+        reserved = 0
+        started = 0
+        while started < len(tasks) or running:
+            while started < len(tasks) and len(running) < self.workers:
+                budget = None
+                if self.nodeLimit:
+                    slots = min(self.workers, len(tasks) - started + len(running)) - len(running)
+                    budget = max((self.nodeLimit - nodes - reserved) // slots, 1)
+                    reserved += budget
+                running[started] = budget
+                self.pool.apply_async(searchRootMove, (tasks[started] + (budget,),),
+                                      callback=lambda result, i=started: finished.put((i, result)),
+                                      error_callback=lambda error, i=started: finished.put((i, error)))
+                started += 1
+            i, result = finished.get()
+            if isinstance(result, BaseException):
+                raise result
+            results[i] = result
+            nodes += result[2]
+            reserved -= running.pop(i) or 0
+            if result[1] is None:
+                started = len(tasks)
+        return results, nodes
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+workerBot = None
+workerPosition = (None, None)
+
+
+def initWorker(tableSize, tablebaseDirectory=None):
+    global workerBot
+    tablebases = None
+    if tablebaseDirectory is not None:
+        from Tablebase import Tablebases
+        tablebases = Tablebases(tablebaseDirectory)
+    workerBot = AlphaBetaBot(timeLimit=None, tableSize=tableSize, tablebases=tablebases)
+
+
+# Searches one root move in a pool process and returns (move code, score or None on timeout, nodes, pv codes)
+def searchRootMove(task):
+    global workerPosition
+    position, code, depth, alpha, deadline, nodeLimit = task
+    if deadline is not None and time.time() > deadline:
+        return code, None, 0, []
+    if workerPosition[0] != position:
+        workerPosition = (position, position[0].fromBytes(position[1]))
+    state = workerPosition[1]
+    bot = workerBot
+    bot.table.newSearch()
+    bot.nodes = 0
+    bot.nodeLimit = nodeLimit
+    bot.deadline = time.perf_counter() + (deadline - time.time()) if deadline is not None else None
+    move = next(m for m in state.getValidMoves() if m.code == code)
+    state.makeMove(move)
+    try:
+        score = -bot.negamax(state, depth - 1, -MATE - 1, -alpha, 1)
+        line = [m.code for m in bot.principalVariation(state, depth - 1)]
+    except SearchTimeout:
+        score, line = None, []
+    finally:
+        state.undoMove()
+    return code, score, bot.nodes, line
+
+
+# Turns a list of move codes played from state into Move objects, stopping at the first one that isn't legal
+def replayLine(state, codes):
+    line = []
+    for code in codes:
+        move = next((m for m in state.getValidMoves() if m.code == code), None)
+        if move is None:
+            break
+        line.append(move)
+        state.makeMove(move)
+    for _ in line:
+        state.undoMove()
+    return line
+
+
+# Fixed depth search time with one process against 1..n worker processes, to see how the root split scales
+def scaling(fen=None, depth=4, workerCounts=(1, 2, 4), stateClass=None):
+    from ChessEngine import GameState
+    stateClass = stateClass or GameState
+    serial = AlphaBetaBot(maxDepth=depth, timeLimit=None)
+    serial.search(stateClass(fen) if fen else stateClass())
+    baseline = serial.stats["time"]
+    print("serial     depth %d  nodes %9d  %6.2fs" % (depth, serial.stats["nodes"], baseline))
+    for workers in workerCounts:
+        bot = ParallelBot(workers, maxDepth=depth, timeLimit=None)
+        try:
+            move, score = bot.search(stateClass(fen) if fen else stateClass())
+        finally:
+            bot.close()
+        print("%2d workers depth %d  nodes %9d  %6.2fs  speedup %.2fx  move %s" %
+              (workers, depth, bot.stats["nodes"], bot.stats["time"], baseline / bot.stats["time"],
+               move.getNotation()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parallel search scaling benchmark")
+    parser.add_argument("--fen")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--bitboard", action="store_true", help="use the bitboard backend")
+    args = parser.parse_args()
+    from Bitboard import BitboardState
+    scaling(args.fen, args.depth, args.workers, BitboardState if args.bitboard else None)
@@ -0,0 +1,712 @@
+from ChessEngine import Castling, Move, encodeMove, mvvLva, stagedOrder, SEE_VALUES, exchangeValue
+from ChessEngine import PROMOTION, ENPASSANT, CASTLE
+from ChessEngine import ZOBRIST_PIECES, ZOBRIST_CASTLING, ZOBRIST_ENPASSANT, ZOBRIST_SIDE
+from ChessEngine import SNAPSHOT, SNAPSHOT_PIECES, packSnapshot, moveClocks, toFEN
+from Evaluation import PSQT_MG, PSQT_EG, PHASE, evalTerms, taperedScore
+
+# Bitboard position backend. Squares are numbered row * 8 + col with row 0 being black's back rank, the same layout as
+# GameState.board, and bit n of every bitboard is square n. It exposes the same getValidMoves / makeMove / undoMove
+# surface as GameState, so ChessMain and the bots can use either one.
+
+PIECES = ['wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK']
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+P, N, B, R, Q, K = range(6)
+BLACK = 6
+FULL = (1 << 64) - 1
+
+# Castling rights as bits, same order as the Castling fields
+WKS, WQS, BKS, BQS = 1, 2, 4, 8
+
+
+def inBound(x, y):
+    return 0 <= x <= 7 and 0 <= y <= 7
+
+
+def stepTable(steps):
+    table = []
+    for sq in range(64):
+        x, y = divmod(sq, 8)
+        bits = 0
+        for (i, j) in steps:
+            if inBound(x + i, y + j):
+                bits |= 1 << ((x + i) * 8 + y + j)
+        table.append(bits)
+    return table
+
+
+KNIGHT_ATTACKS = stepTable([(-2, -1), (-1, -2), (-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2)])
+KING_ATTACKS = stepTable([(-1, 0), (0, -1), (0, 1), (1, 0), (-1, 1), (1, -1), (-1, -1), (1, 1)])
+# PAWN_ATTACKS[0] are the squares a white pawn attacks, PAWN_ATTACKS[1] a black pawn
+PAWN_ATTACKS = [stepTable([(-1, -1), (-1, 1)]), stepTable([(1, -1), (1, 1)])]
+
+# Ray directions, positive ones go towards higher square numbers so their first blocker is the lowest set bit
+ROOK_DIRECTIONS = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+POSITIVE = {(1, 0), (0, 1), (1, 1), (1, -1)}
+
+
+def rayTable(direction):
+    table = []
+    for sq in range(64):
+        x, y = divmod(sq, 8)
+        bits = 0
+        k = 1
+        while inBound(x + k * direction[0], y + k * direction[1]):
+            bits |= 1 << ((x + k * direction[0]) * 8 + y + k * direction[1])
+            k += 1
+        table.append(bits)
+    return table
+
+
+RAYS = {d: rayTable(d) for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+ROOK_RAYS = [(RAYS[d], d in POSITIVE) for d in ROOK_DIRECTIONS]
+BISHOP_RAYS = [(RAYS[d], d in POSITIVE) for d in BISHOP_DIRECTIONS]
+ROOK_LINES = [RAYS[(1, 0)][sq] | RAYS[(0, 1)][sq] | RAYS[(-1, 0)][sq] | RAYS[(0, -1)][sq] for sq in range(64)]
+BISHOP_LINES = [RAYS[(1, 1)][sq] | RAYS[(1, -1)][sq] | RAYS[(-1, 1)][sq] | RAYS[(-1, -1)][sq] for sq in range(64)]
+
+# BETWEEN[a][b] holds the squares strictly between a and b, LINE[a][b] the whole line through both (0 if not aligned)
+BETWEEN = [[0] * 64 for _ in range(64)]
+LINE = [[0] * 64 for _ in range(64)]
+for _sq in range(64):
+    for _d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+        _ray = RAYS[_d][_sq]
+        _back = RAYS[(-_d[0], -_d[1])][_sq]
+        _bits = _ray
+        while _bits:
+            _lsb = _bits & -_bits
+            _target = _lsb.bit_length() - 1
+            BETWEEN[_sq][_target] = _ray & ~RAYS[_d][_target] & ~_lsb
+            LINE[_sq][_target] = _ray | _back | (1 << _sq)
+            _bits ^= _lsb
+
+FILE_A = sum(1 << (row * 8) for row in range(8))
+FILE_H = FILE_A << 7
+# Rows a pawn lands on after a single push from its start row, white first
+THIRD_ROWS = [0xFF << 40, 0xFF << 16]
+PROMOTION_ROWS = 0xFF | 0xFF << 56
+KIND_VALUES = [SEE_VALUES[piece] for piece in 'PNBRQK']
+
+# Rights that survive a move touching each square
+CASTLE_MASK = [15] * 64
+CASTLE_MASK[60] = 15 & ~(WKS | WQS)
+CASTLE_MASK[63] = 15 & ~WKS
+CASTLE_MASK[56] = 15 & ~WQS
+CASTLE_MASK[4] = 15 & ~(BKS | BQS)
+CASTLE_MASK[7] = 15 & ~BKS
+CASTLE_MASK[0] = 15 & ~BQS
+
+
+def slidingAttacks(sq, occupied, rays):
+    attacks = 0
+    for (table, positive) in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if positive:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= table[blocker]
+        attacks |= ray
+    return attacks
+
+
+# Sliding attack lookups: attacks only depend on the occupancy of the relevant squares (the lines without their edge
+# squares), so they are memoized per square keyed by that masked occupancy, which behaves like a magic bitboard table
+# with the dict as the perfect hash. Tables fill lazily and are bounded by 4096 entries per square.
+EDGES = [sum(1 << sq for sq in range(64) if sq // 8 in (0, 7)), sum(1 << sq for sq in range(64) if sq % 8 in (0, 7))]
+
+
+def relevantMask(sq, directions):
+    mask = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        if d[0]:
+            ray &= ~EDGES[0]
+        if d[1]:
+            ray &= ~EDGES[1]
+        mask |= ray
+    return mask
+
+
+ROOK_MASKS = [relevantMask(sq, ROOK_DIRECTIONS) for sq in range(64)]
+BISHOP_MASKS = [relevantMask(sq, BISHOP_DIRECTIONS) for sq in range(64)]
+ROOK_TABLE = [{} for _ in range(64)]
+BISHOP_TABLE = [{} for _ in range(64)]
+
+
+def rookAttacks(sq, occupied):
+    key = occupied & ROOK_MASKS[sq]
+    attacks = ROOK_TABLE[sq].get(key)
+    if attacks is None:
+        attacks = ROOK_TABLE[sq][key] = slidingAttacks(sq, key, ROOK_RAYS)
+    return attacks
+
+
+def bishopAttacks(sq, occupied):
+    key = occupied & BISHOP_MASKS[sq]
+    attacks = BISHOP_TABLE[sq].get(key)
+    if attacks is None:
+        attacks = BISHOP_TABLE[sq][key] = slidingAttacks(sq, key, BISHOP_RAYS)
+    return attacks
+
+
+# Moves are immutable once generated, so each (piece, from, to, captured) move is built once and shared between
+# positions instead of allocating a new Move for every generated move. MOVE_TABLE[piece][from][to] maps the captured
+# piece to the move.
+MOVE_TABLE = [[[{} for _ in range(64)] for _ in range(64)] for _ in range(12)]
+
+
+def cachedMove(start, end, moved, captured):
+    byCapture = MOVE_TABLE[PIECE_INDEX[moved]][start][end]
+    move = byCapture.get(captured)
+    if move is None:
+        move = byCapture[captured] = newMove(start, end, moved, captured)
+    return move
+
+
+def newMove(start, end, moved, captured, isEnpassant=False, isCastleMove=False):
+    move = Move.__new__(Move)
+    move.startR, move.startC = divmod(start, 8)
+    move.endR, move.endC = divmod(end, 8)
+    move.pieceMoved = moved
+    move.pieceCaptured = captured
+    move.isPawnPromotion = moved[1] == 'P' and (move.endR == 0 or move.endR == 7)
+    move.isEnpassantMove = isEnpassant
+    move.isCastleMove = isCastleMove
+    move.moveID = move.startR * 1000 + move.startC * 100 + move.endR * 10 + move.endC
+    move.code = encodeMove(start, end, (PROMOTION if move.isPawnPromotion else 0) |
+                           (ENPASSANT if isEnpassant else 0) | (CASTLE if isCastleMove else 0))
+    return move
+
+
+class BitboardState:
+    moveCache = None  # a ChessEngine.MoveCache consulted by getValidMoves, off by default
+    debugZobrist = False
+    debugEvaluation = False
+    def __init__(self, fen=None):
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0]
+        self.squares = ['--'] * 64
+        self.whiteMoves = True
+        self.castling = 0
+        self.enpassantSquare = -1
+        self.moveLog = []
+        self.history = []
+        self.inCheck = False
+        self.checkmate = False
+        self.stalemate = False
+        self.zobristKey = 0
+        self.evalTerms = (0, 0, 0)
+        self.baseHalfmove = 0
+        self.baseFullmove = 1
+        self.loadFEN(fen or "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1")
+
+    def loadFEN(self, fen):
+        fields = fen.split()
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0]
+        self.squares = ['--'] * 64
+        sq = 0
+        for ch in fields[0]:
+            if ch == '/':
+                continue
+            if ch.isdigit():
+                sq += int(ch)
+            else:
+                self.putPiece(('w' if ch.isupper() else 'b') + ch.upper(), sq)
+                sq += 1
+        self.whiteMoves = len(fields) < 2 or fields[1] == 'w'
+        rights = fields[2] if len(fields) > 2 else '-'
+        self.castling = (WKS if 'K' in rights else 0) | (WQS if 'Q' in rights else 0) | \
+                        (BKS if 'k' in rights else 0) | (BQS if 'q' in rights else 0)
+        self.enpassantSquare = -1
+        if len(fields) > 3 and fields[3] != '-':
+            self.enpassantSquare = Move.ranksToRows[fields[3][1]] * 8 + Move.filesToCols[fields[3][0]]
+        self.baseHalfmove = int(fields[4]) if len(fields) > 4 else 0
+        self.baseFullmove = int(fields[5]) if len(fields) > 5 else 1
+        self.positionLoaded()
+
+    def getFEN(self):
+        return toFEN(self)
+
+    # Same snapshot format as GameState.toBytes, so snapshots move freely between the backends
+    def toBytes(self):
+        return packSnapshot(self.squares, self.whiteMoves, self.castling, self.enpassantSquare, *moveClocks(self))
+
+    def loadBytes(self, data):
+        squares, flags, enpassant, self.baseHalfmove, self.baseFullmove = SNAPSHOT.unpack(data)
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0]
+        self.squares = ['--'] * 64
+        for sq, code in enumerate(squares):
+            if code:
+                self.putPiece(SNAPSHOT_PIECES[code], sq)
+        self.whiteMoves = not flags & 1
+        self.castling = flags >> 1
+        self.enpassantSquare = enpassant if enpassant < 64 else -1
+        self.positionLoaded()
+
+    @classmethod
+    def fromBytes(cls, data):
+        state = cls.__new__(cls)
+        state.loadBytes(data)
+        return state
+
+    def clone(self):
+        return self.fromBytes(self.toBytes())
+
+    def positionLoaded(self):
+        self.moveLog = []
+        self.history = []
+        self.inCheck = False
+        self.checkmate = False
+        self.stalemate = False
+        self.zobristKey = self.computeZobrist()
+        self.evalTerms = evalTerms(self.squares)
+
+    # Same keys as GameState.computeZobrist, so both backends agree on a position's key
+    def computeZobrist(self):
+        key = ZOBRIST_CASTLING[self.castling]
+        for sq in range(64):
+            key ^= ZOBRIST_PIECES[self.squares[sq]][sq]
+        if self.enpassantSquare >= 0:
+            key ^= ZOBRIST_ENPASSANT[self.enpassantSquare % 8]
+        if not self.whiteMoves:
+            key ^= ZOBRIST_SIDE
+        return key
+
+    def checkZobrist(self):
+        if self.zobristKey != self.computeZobrist():
+            raise AssertionError("Zobrist key out of sync after " + " ".join(m.getNotation() for m in self.moveLog))
+
+    def checkEvaluation(self):
+        if self.evalTerms != evalTerms(self.squares):
+            raise AssertionError("Evaluation out of sync after " + " ".join(m.getNotation() for m in self.moveLog))
+
+    def evaluation(self):
+        return taperedScore(self.evalTerms, self.whiteMoves)
+
+    def putPiece(self, piece, sq):
+        index = PIECE_INDEX[piece]
+        self.bitboards[index] |= 1 << sq
+        self.occupancy[index // BLACK] |= 1 << sq
+        self.squares[sq] = piece
+
+    # GameState compatible views, built on demand for the UI
+    @property
+    def board(self):
+        return [self.squares[row * 8:row * 8 + 8] for row in range(8)]
+
+    @property
+    def wKing(self):
+        return divmod(self.bitboards[K].bit_length() - 1, 8)
+
+    @property
+    def bKing(self):
+        return divmod(self.bitboards[BLACK + K].bit_length() - 1, 8)
+
+    @property
+    def pieceCounts(self):
+        return {piece: self.bitboards[i].bit_count() for i, piece in enumerate(PIECES)}
+
+    @property
+    def enpassant(self):
+        return divmod(self.enpassantSquare, 8) if self.enpassantSquare >= 0 else ()
+
+    @property
+    def currentCastling(self):
+        return Castling(bool(self.castling & WKS), bool(self.castling & BKS),
+                        bool(self.castling & WQS), bool(self.castling & BQS))
+
+    def makeMove(self, move):
+        start = move.startR * 8 + move.startC
+        end = move.endR * 8 + move.endC
+        squares = self.squares
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        moved = squares[start]
+        captured = squares[end]
+        movedIndex = PIECE_INDEX[moved]
+        us = 0 if self.whiteMoves else 1
+        them = 1 - us
+        self.history.append((captured, self.castling, self.enpassantSquare, self.zobristKey, self.evalTerms))
+        self.moveLog.append(move)
+        key = self.zobristKey ^ ZOBRIST_SIDE ^ ZOBRIST_PIECES[moved][start] ^ ZOBRIST_PIECES[captured][end]
+        mg, eg, phase = self.evalTerms
+        mg -= PSQT_MG[moved][start] + PSQT_MG[captured][end]
+        eg -= PSQT_EG[moved][start] + PSQT_EG[captured][end]
+        phase -= PHASE[moved] + PHASE[captured]
+
+        fromTo = (1 << start) | (1 << end)
+        if captured != '--':
+            capturedIndex = PIECE_INDEX[captured]
+            bitboards[capturedIndex] ^= 1 << end
+            occupancy[them] ^= 1 << end
+        bitboards[movedIndex] ^= fromTo
+        occupancy[us] ^= fromTo
+        squares[start] = '--'
+        squares[end] = moved
+
+        kind = movedIndex - us * BLACK
+        if kind == P:
+            if end == self.enpassantSquare:
+                victim = end + 8 if us == 0 else end - 8
+                move.pieceCaptured = squares[victim]
+                bitboards[them * BLACK + P] ^= 1 << victim
+                occupancy[them] ^= 1 << victim
+                squares[victim] = '--'
+                key ^= ZOBRIST_PIECES[move.pieceCaptured][victim]
+                mg -= PSQT_MG[move.pieceCaptured][victim]
+                eg -= PSQT_EG[move.pieceCaptured][victim]
+            elif end < 8 or end >= 56:
+                bitboards[movedIndex] ^= 1 << end
+                bitboards[movedIndex + Q - P] |= 1 << end
+                squares[end] = moved[0] + 'Q'
+        elif kind == K and abs(end - start) == 2:
+            if end > start:
+                rookFrom, rookTo = end + 1, end - 1
+            else:
+                rookFrom, rookTo = end - 2, end + 1
+            rookMove = (1 << rookFrom) | (1 << rookTo)
+            bitboards[us * BLACK + R] ^= rookMove
+            occupancy[us] ^= rookMove
+            squares[rookTo] = squares[rookFrom]
+            squares[rookFrom] = '--'
+            key ^= ZOBRIST_PIECES[squares[rookTo]][rookFrom] ^ ZOBRIST_PIECES[squares[rookTo]][rookTo]
+            mg += PSQT_MG[squares[rookTo]][rookTo] - PSQT_MG[squares[rookTo]][rookFrom]
+            eg += PSQT_EG[squares[rookTo]][rookTo] - PSQT_EG[squares[rookTo]][rookFrom]
+        key ^= ZOBRIST_PIECES[squares[end]][end]
+        self.evalTerms = (mg + PSQT_MG[squares[end]][end], eg + PSQT_EG[squares[end]][end],
+                          phase + PHASE[squares[end]])
+
+        key ^= ZOBRIST_CASTLING[self.castling]
+        self.castling &= CASTLE_MASK[start] & CASTLE_MASK[end]
+        key ^= ZOBRIST_CASTLING[self.castling]
+        if self.enpassantSquare >= 0:
+            key ^= ZOBRIST_ENPASSANT[self.enpassantSquare % 8]
+        if kind == P and abs(end - start) == 16:
+            self.enpassantSquare = (start + end) // 2
+            key ^= ZOBRIST_ENPASSANT[end % 8]
+        else:
+            self.enpassantSquare = -1
+        self.zobristKey = key
+        self.whiteMoves = not self.whiteMoves
+        if self.debugZobrist:
+            self.checkZobrist()
+        if self.debugEvaluation:
+            self.checkEvaluation()
+
+    def undoMove(self):
+        if len(self.moveLog) == 0:
+            return
+        move = self.moveLog.pop()
+        captured, self.castling, self.enpassantSquare, self.zobristKey, self.evalTerms = self.history.pop()
+        self.whiteMoves = not self.whiteMoves
+        start = move.startR * 8 + move.startC
+        end = move.endR * 8 + move.endC
+        squares = self.squares
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        us = 0 if self.whiteMoves else 1
+        them = 1 - us
+        moved = move.pieceMoved
+        movedIndex = PIECE_INDEX[moved]
+        kind = movedIndex - us * BLACK
+
+        if kind == P and (end < 8 or end >= 56):
+            bitboards[movedIndex + Q - P] ^= 1 << end
+            bitboards[movedIndex] |= 1 << end
+        fromTo = (1 << start) | (1 << end)
+        bitboards[movedIndex] ^= fromTo
+        occupancy[us] ^= fromTo
+        squares[start] = moved
+        squares[end] = captured
+        if captured != '--':
+            bitboards[PIECE_INDEX[captured]] |= 1 << end
+            occupancy[them] |= 1 << end
+
+        if kind == P and end == self.enpassantSquare:
+            victim = end + 8 if us == 0 else end - 8
+            bitboards[them * BLACK + P] |= 1 << victim
+            occupancy[them] |= 1 << victim
+            squares[victim] = move.pieceCaptured
+        elif kind == K and abs(end - start) == 2:
+            if end > start:
+                rookFrom, rookTo = end + 1, end - 1
+            else:
+                rookFrom, rookTo = end - 2, end + 1
+            rookMove = (1 << rookFrom) | (1 << rookTo)
+            bitboards[us * BLACK + R] ^= rookMove
+            occupancy[us] ^= rookMove
+            squares[rookFrom] = squares[rookTo]
+            squares[rookTo] = '--'
+        if self.debugZobrist:
+            self.checkZobrist()
+        if self.debugEvaluation:
+            self.checkEvaluation()
+
+    # Bitboard of the pieces of side `by` (0 white, 1 black) attacking sq, given the occupancy
+    def attackersTo(self, sq, by, occupied):
+        bitboards = self.bitboards
+        base = by * BLACK
+        attackers = (PAWN_ATTACKS[1 - by][sq] & bitboards[base + P]) | \
+                    (KNIGHT_ATTACKS[sq] & bitboards[base + N]) | \
+                    (KING_ATTACKS[sq] & bitboards[base + K])
+        rooks = bitboards[base + R] | bitboards[base + Q]
+        if ROOK_LINES[sq] & rooks:
+            attackers |= rookAttacks(sq, occupied) & rooks
+        bishops = bitboards[base + B] | bitboards[base + Q]
+        if BISHOP_LINES[sq] & bishops:
+            attackers |= bishopAttacks(sq, occupied) & bishops
+        return attackers
+
+    def isAttacked(self, sq, by, occupied):
+        bitboards = self.bitboards
+        base = by * BLACK
+        if PAWN_ATTACKS[1 - by][sq] & bitboards[base + P] or KNIGHT_ATTACKS[sq] & bitboards[base + N] or \
+                KING_ATTACKS[sq] & bitboards[base + K]:
+            return True
+        rooks = bitboards[base + R] | bitboards[base + Q]
+        if ROOK_LINES[sq] & rooks and rookAttacks(sq, occupied) & rooks:
+            return True
+        bishops = bitboards[base + B] | bitboards[base + Q]
+        return bool(BISHOP_LINES[sq] & bishops and bishopAttacks(sq, occupied) & bishops)
+
+    def Check(self):
+        us = 0 if self.whiteMoves else 1
+        king = self.bitboards[us * BLACK + K].bit_length() - 1
+        return self.isAttacked(king, 1 - us, self.occupancy[0] | self.occupancy[1])
+
+    def squareUnderAttack(self, x, y):
+        return self.isAttacked(x * 8 + y, 1 if self.whiteMoves else 0, self.occupancy[0] | self.occupancy[1])
+
+    # Same stages as GameState.getStagedMoves. Generating every move set-wise is cheap here, so the list is built at
+    # once and only the ordering is done per stage.
+    def getStagedMoves(self, hashMove=None):
+        yield from stagedOrder(self.getValidMoves(), hashMove)
+
+    # With tactical=True and the side to move not in check, only captures and promotions are generated. Full move
+    # lists go through the move cache when there is one.
+    def getValidMoves(self, tactical=False):
+        if tactical or self.moveCache is None:
+            return self.generateValidMoves(tactical)
+        entry = self.moveCache.get(self.zobristKey)
+        if entry is None:
+            entry = self.moveCache.put(self.zobristKey, self.generateValidMoves(), self.inCheck)
+        self.inCheck = entry[1]
+        return list(entry[0])
+
+    def generateValidMoves(self, tactical=False):
+        moves = []
+        bitboards = self.bitboards
+        squares = self.squares
+        us = 0 if self.whiteMoves else 1
+        them = 1 - us
+        base = us * BLACK
+        ours = self.occupancy[us]
+        theirs = self.occupancy[them]
+        occupied = ours | theirs
+        kingBit = bitboards[base + K]
+        king = kingBit.bit_length() - 1
+        kingPiece = squares[king]
+
+        checkers = self.attackersTo(king, them, occupied)
+        self.inCheck = checkers != 0
+        capturesOnly = tactical and not checkers
+
+        # King moves, tested with the king lifted off the board so it can't hide behind itself
+        withoutKing = occupied ^ kingBit
+        targets = KING_ATTACKS[king] & (theirs if capturesOnly else ~ours)
+        while targets:
+            lsb = targets & -targets
+            targets ^= lsb
+            end = lsb.bit_length() - 1
+            if not self.isAttacked(end, them, withoutKing):
+                moves.append(cachedMove(king, end, kingPiece, squares[end]))
+        if checkers & (checkers - 1):
+            return moves
+
+        # Only captures of the checker or blocks on the check ray answer a single check
+        if checkers:
+            checker = checkers.bit_length() - 1
+            allowed = BETWEEN[king][checker] | checkers
+        elif capturesOnly:
+            allowed = theirs | PROMOTION_ROWS  # pawns still push to the last row
+        else:
+            allowed = FULL
+
+        # Pinned pieces may only move along the line between the king and the pinner
+        pinned = 0
+        pinLines = {}
+        enemyRooks = bitboards[them * BLACK + R] | bitboards[them * BLACK + Q]
+        enemyBishops = bitboards[them * BLACK + B] | bitboards[them * BLACK + Q]
+        snipers = 0
+        if ROOK_LINES[king] & enemyRooks:
+            snipers |= rookAttacks(king, theirs) & enemyRooks
+        if BISHOP_LINES[king] & enemyBishops:
+            snipers |= bishopAttacks(king, theirs) & enemyBishops
+        while snipers:
+            lsb = snipers & -snipers
+            snipers ^= lsb
+            sniper = lsb.bit_length() - 1
+            blockers = BETWEEN[king][sniper] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & ours:
+                pinned |= blockers
+                pinLines[blockers.bit_length() - 1] = LINE[king][sniper]
+
+        targetMask = theirs if capturesOnly else ~ours & allowed
+        for kind, attacks in ((N, None), (B, bishopAttacks), (R, rookAttacks), (Q, None)):
+            pieces = bitboards[base + kind]
+            piece = PIECES[base + kind]
+            table = MOVE_TABLE[base + kind]
+            while pieces:
+                lsb = pieces & -pieces
+                pieces ^= lsb
+                start = lsb.bit_length() - 1
+                if kind == N:
+                    if lsb & pinned:
+                        continue
+                    targets = KNIGHT_ATTACKS[start] & targetMask
+                elif kind == Q:
+                    targets = (rookAttacks(start, occupied) | bishopAttacks(start, occupied)) & targetMask
+                else:
+                    targets = attacks(start, occupied) & targetMask
+                if lsb & pinned:
+                    targets &= pinLines[start]
+                row = table[start]
+                while targets:
+                    tlsb = targets & -targets
+                    targets ^= tlsb
+                    end = tlsb.bit_length() - 1
+                    captured = squares[end]
+                    move = row[end].get(captured)
+                    if move is None:
+                        move = row[end][captured] = newMove(start, end, piece, captured)
+                    moves.append(move)
+
+        self.getPawnMoves(moves, us, occupied, theirs, allowed, pinned, pinLines, king, checkers)
+        if not checkers and not tactical:
+            self.getCastleMoves(moves, us, occupied, king)
+        return moves
+
+    # Captures and promotions, best victims first, for quiescence search. Every legal move when in check.
+    def getTacticalMoves(self):
+        moves = self.getValidMoves(tactical=True)
+        if not self.inCheck:
+            moves.sort(key=lambda move: mvvLva(move) if move.pieceCaptured != '--' else 0, reverse=True)
+        return moves
+
+    # Static exchange evaluation, see GameState.see. Attackers are recomputed with the pieces that have already
+    # captured lifted off the occupancy, which brings in the x-rays behind them.
+    def see(self, move):
+        start = move.startR * 8 + move.startC
+        end = move.endR * 8 + move.endC
+        bitboards = self.bitboards
+        values = [SEE_VALUES[move.pieceCaptured[1]]]
+        onSquare = SEE_VALUES[move.pieceMoved[1]]
+        if move.isPawnPromotion:
+            values[0] += SEE_VALUES['Q'] - SEE_VALUES['P']
+            onSquare = SEE_VALUES['Q']
+        occupied = (self.occupancy[0] | self.occupancy[1]) ^ (1 << start)
+        if move.isEnpassantMove:
+            occupied ^= 1 << (move.startR * 8 + move.endC)
+        side = 1 if move.pieceMoved[0] == 'w' else 0
+        while True:
+            attackers = self.attackersTo(end, side, occupied) & occupied
+            if not attackers:
+                break
+            for kind in range(6):
+                bits = attackers & bitboards[side * BLACK + kind]
+                if bits:
+                    break
+            values.append(onSquare)
+            onSquare = KIND_VALUES[kind]
+            occupied ^= bits & -bits
+            side = 1 - side
+        return exchangeValue(values)
+
+    # Unpinned pawns are generated set-wise by shifting the whole pawn bitboard, pinned ones one at a time
+    def getPawnMoves(self, moves, us, occupied, theirs, allowed, pinned, pinLines, king, checkers):
+        squares = self.squares
+        pawns = self.bitboards[us * BLACK + P]
+        piece = PIECES[us * BLACK + P]
+        table = MOVE_TABLE[us * BLACK + P]
+        step = -8 if us == 0 else 8
+        free = pawns & ~pinned
+        empty = ~occupied & FULL
+        if us == 0:
+            single = (free >> 8) & empty
+            double = ((single & THIRD_ROWS[0]) >> 8) & empty
+            left = ((free & ~FILE_A) >> 9) & theirs
+            right = ((free & ~FILE_H) >> 7) & theirs
+        else:
+            single = (free << 8) & empty
+            double = ((single & THIRD_ROWS[1]) << 8) & empty
+            left = ((free & ~FILE_A) << 7) & theirs
+            right = ((free & ~FILE_H) << 9) & theirs
+        for targets, offset in ((single & allowed, step), (double & allowed, 2 * step),
+                                (left & allowed, step - 1), (right & allowed, step + 1)):
+            while targets:
+                tlsb = targets & -targets
+                targets ^= tlsb
+                end = tlsb.bit_length() - 1
+                start = end - offset
+                captured = squares[end]
+                move = table[start][end].get(captured)
+                if move is None:
+                    move = table[start][end][captured] = newMove(start, end, piece, captured)
+                moves.append(move)
+
+        stuck = pawns & pinned
+        while stuck:
+            lsb = stuck & -stuck
+            stuck ^= lsb
+            start = lsb.bit_length() - 1
+            line = pinLines[start] & allowed
+            end = start + step
+            if not (1 << end) & occupied:
+                if (1 << end) & line:
+                    moves.append(cachedMove(start, end, piece, '--'))
+                if start // 8 == (6 if us == 0 else 1) and not (1 << (end + step)) & occupied and \
+                        (1 << (end + step)) & line:
+                    moves.append(cachedMove(start, end + step, piece, '--'))
+            targets = PAWN_ATTACKS[us][start] & theirs & line
+            while targets:
+                tlsb = targets & -targets
+                targets ^= tlsb
+                end = tlsb.bit_length() - 1
+                moves.append(cachedMove(start, end, piece, squares[end]))
+
+        ep = self.enpassantSquare
+        if ep < 0:
+            return
+        victim = ep - step
+        if checkers and not (checkers & (1 << victim) or allowed & (1 << ep)):
+            return
+        base = (1 - us) * BLACK
+        rooks = self.bitboards[base + R] | self.bitboards[base + Q]
+        bishops = self.bitboards[base + B] | self.bitboards[base + Q]
+        candidates = PAWN_ATTACKS[1 - us][ep] & pawns
+        while candidates:
+            lsb = candidates & -candidates
+            candidates ^= lsb
+            start = lsb.bit_length() - 1
+            # Both pawns leave their squares at once, so look for a discovered attack on the king directly
+            after = (occupied ^ lsb ^ (1 << victim)) | (1 << ep)
+            if not (rookAttacks(king, after) & rooks or bishopAttacks(king, after) & bishops):
+                moves.append(newMove(start, ep, piece, squares[victim], isEnpassant=True))
+
+    def getCastleMoves(self, moves, us, occupied, king):
+        them = 1 - us
+        if us == 0:
+            kingSide, queenSide = self.castling & WKS, self.castling & WQS
+        else:
+            kingSide, queenSide = self.castling & BKS, self.castling & BQS
+        piece = self.squares[king]
+        if kingSide and not occupied & ((1 << (king + 1)) | (1 << (king + 2))):
+            if not self.isAttacked(king + 1, them, occupied) and not self.isAttacked(king + 2, them, occupied):
+                moves.append(newMove(king, king + 2, piece, '--', isCastleMove=True))
+        if queenSide and not occupied & ((1 << (king - 1)) | (1 << (king - 2)) | (1 << (king - 3))):
+            if not self.isAttacked(king - 1, them, occupied) and not self.isAttacked(king - 2, them, occupied):
+                moves.append(newMove(king, king - 2, piece, '--', isCastleMove=True))
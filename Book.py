@@ -0,0 +1,145 @@
+import argparse
+import json
+import mmap
+import os
+import random
+import struct
+from Bitboard import BitboardState
+import PGN
+
+# Opening book in the Polyglot layout: 16 byte big endian entries of (key, move, weight, learn) sorted by key. Keys
+# are our own Zobrist keys and moves our Move.code, not Polyglot's, so books are built with the builder below. The
+# file is memory mapped and binary searched, so opening even a large book costs nothing up front.
+ENTRY = struct.Struct('>QHHI')
+KEY = struct.Struct('>Q')
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.entries = size // ENTRY.size
+
+    # (move code, weight) for every book move of the position with this key
+    def probe(self, key):
+        low, high = 0, self.entries
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        while low < self.entries:
+            entryKey, code, weight, learn = ENTRY.unpack_from(self.data, low * ENTRY.size)
+            if entryKey != key:
+                break
+            found.append((code, weight))
+            low += 1
+        return found
+
+    # Book moves of the position as (Move, weight), limited to the given legal moves
+    def moves(self, state, moves=None):
+        found = self.probe(state.zobristKey)
+        if not found:
+            return []
+        byCode = {move.code: move for move in (moves if moves is not None else state.getValidMoves())}
+        return [(byCode[code], weight) for code, weight in found if code in byCode and weight > 0]
+
+    # A book move picked at random in proportion to its weight, or None when the position is out of book
+    def choose(self, state, moves=None, rng=random):
+        candidates = self.moves(state, moves)
+        if not candidates:
+            return None
+        return rng.choices([move for move, weight in candidates], [weight for move, weight in candidates])[0]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+
+# Points for the side that played a move, Polyglot style: 2 for a win, 1 for a draw, 0 for a loss. Games without a
+# result count every move once.
+def movePoints(result, whiteMoved):
+    if result == "1/2-1/2":
+        return 1
+    if result in ("1-0", "0-1"):
+        return 2 if (result == "1-0") == whiteMoved else 0
+    return 1
+
+
+# Games from tournament JSONL files (the "moves" and "result" fields), PGN files or text files with one game per
+# line as moves in coordinate notation, optionally followed by the result. Yields (moves, result).
+def readGames(path):
+    if path.endswith('.pgn'):
+        for game in PGN.readGames(path):
+            if "FEN" in game["tags"]:
+                continue
+            try:
+                yield [move.getNotation() for move in PGN.replayGame(game, BitboardState)], game["result"]
+            except ValueError:
+                continue
+        return
+    with open(path) as games:
+        for line in games:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                record = json.loads(line)
+                yield record["moves"], record.get("result")
+            else:
+                moves = line.split()
+                result = moves.pop() if moves[-1] in ("1-0", "0-1", "1/2-1/2", "*") else None
+                yield moves, result
+
+
+# Replays the first maxPlies moves of every game and writes the sorted book. Returns the number of entries.
+def buildBook(paths, out, maxPlies=16, minWeight=1):
+    weights = {}
+    for path in paths:
+        for notations, result in readGames(path):
+            state = BitboardState()
+            for notation in notations[:maxPlies]:
+                move = next((m for m in state.getValidMoves() if m.getNotation() == notation), None)
+                if move is None:
+                    break
+                entry = (state.zobristKey, move.code)
+                weights[entry] = weights.get(entry, 0) + movePoints(result, state.whiteMoves)
+                state.makeMove(move)
+    entries = sorted((key, code, min(weight, 65535)) for (key, code), weight in weights.items() if weight >= minWeight)
+    with open(out, 'wb') as book:
+        for key, code, weight in entries:
+            book.write(ENTRY.pack(key, code, weight, 0))
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="compile a book from game files")
+    build.add_argument("games", nargs="+",
+                       help="tournament JSONL, PGN files or text files with one game per line")
+    build.add_argument("--out", required=True)
+    build.add_argument("--plies", type=int, default=16, help="how deep into each game to record moves")
+    build.add_argument("--min-weight", type=int, default=1, help="drop moves with a smaller total weight")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print("%d entries written to %s" % (buildBook(args.games, args.out, args.plies, args.min_weight), args.out))
+    else:
+        book = OpeningBook(args.book)
+        state = BitboardState(args.fen)
+        for move, weight in sorted(book.moves(state), key=lambda candidate: -candidate[1]):
+            print("%s %d" % (move.getNotation(), weight))
+        book.close()
+
+
+if __name__ == '__main__':
+    main()
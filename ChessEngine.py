@@ -1,5 +1,189 @@
+import random
+import struct
+import sys
+from collections import OrderedDict
+from Evaluation import PSQT_MG, PSQT_EG, PHASE, evalTerms, taperedScore
+
+KNIGHT_STEPS = ((-2, -1), (-1, -2), (-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2))
+# Each ray direction with the pieces that attack along it
+RAY_ATTACKERS = (((-1, 0), 'RQ'), ((0, -1), 'RQ'), ((0, 1), 'RQ'), ((1, 0), 'RQ'),
+                 ((-1, -1), 'BQ'), ((-1, 1), 'BQ'), ((1, -1), 'BQ'), ((1, 1), 'BQ'))
+
+
+# Zobrist keys: one random 64-bit number per (piece, square), castling rights combination, en passant file and for
+# black to move. A position's key is the xor of the numbers for everything in it. The seed is fixed so keys stay the
+# same between runs and can be stored.
+zobristRandom = random.Random(20210101)
+ZOBRIST_PIECES = {color + piece: [zobristRandom.getrandbits(64) for _ in range(64)]
+                  for color in 'wb' for piece in 'PNBRQK'}
+ZOBRIST_PIECES['--'] = [0] * 64
+ZOBRIST_CASTLING = [zobristRandom.getrandbits(64) for _ in range(16)]
+ZOBRIST_ENPASSANT = [zobristRandom.getrandbits(64) for _ in range(8)]
+ZOBRIST_SIDE = zobristRandom.getrandbits(64)
+
+
+def castlingIndex(rights):
+    return rights.wks | rights.wqs << 1 | rights.bks << 2 | rights.bqs << 3
+
+
+# Binary snapshot of a position: 64 bytes of pieces (indexes into SNAPSHOT_PIECES, row 0 first), a byte with the side to
+# move in bit 0 and castlingIndex in bits 1-4, the en passant square or 64 for none, the halfmove clock and the fullmove
+# number. 69 bytes in all; the move history is not part of it.
+SNAPSHOT = struct.Struct('<64sBBBH')
+SNAPSHOT_PIECES = ['--', 'wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK']
+SNAPSHOT_CODES = {piece: i for i, piece in enumerate(SNAPSHOT_PIECES)}
+
+
+def packSnapshot(squares, whiteMoves, castling, enpassant, halfmove, fullmove):
+    return SNAPSHOT.pack(bytes(SNAPSHOT_CODES[piece] for piece in squares), (not whiteMoves) | castling << 1,
+                         enpassant if enpassant >= 0 else 64, min(halfmove, 255), min(fullmove, 65535))
+
+
+# Halfmove clock and fullmove number after the moves in moveLog, counted on from the ones the position was loaded with
+def moveClocks(state):
+    halfmove = 0
+    for move in reversed(state.moveLog):
+        if move.pieceMoved[1] == 'P' or move.pieceCaptured != '--':
+            break
+        halfmove += 1
+    else:
+        halfmove += state.baseHalfmove
+    startedWhite = state.whiteMoves == (len(state.moveLog) % 2 == 0)
+    return halfmove, state.baseFullmove + (len(state.moveLog) + (0 if startedWhite else 1)) // 2
+
+
+# FEN of a position, for either backend
+def toFEN(state):
+    rows = []
+    for row in state.board:
+        text = ''
+        empty = 0
+        for piece in row:
+            if piece == '--':
+                empty += 1
+                continue
+            if empty:
+                text += str(empty)
+                empty = 0
+            text += piece[1] if piece[0] == 'w' else piece[1].lower()
+        rows.append(text + (str(empty) if empty else ''))
+    rights = state.currentCastling
+    castling = ('K' if rights.wks else '') + ('Q' if rights.wqs else '') + \
+               ('k' if rights.bks else '') + ('q' if rights.bqs else '')
+    enpassant = '-'
+    if state.enpassant != ():
+        enpassant = Move.colsToFiles[state.enpassant[1]] + Move.rowsToRanks[state.enpassant[0]]
+    halfmove, fullmove = moveClocks(state)
+    return '%s %s %s %s %d %d' % ('/'.join(rows), 'w' if state.whiteMoves else 'b', castling or '-', enpassant,
+                                  halfmove, fullmove)
+
+
+# Most valuable victim / least valuable attacker: higher is searched first
+ORDER_VALUES = {'P': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6}
+
+
+def mvvLva(move):
+    return ORDER_VALUES[move.pieceCaptured[1]] * 8 - ORDER_VALUES[move.pieceMoved[1]]
+
+
+# Orders a full legal move list in the stages of getStagedMoves: the hash move, captures by MVV-LVA, quiet promotions,
+# then the other quiet moves
+def stagedOrder(moves, hashMove):
+    captures = []
+    quiet = []
+    for move in moves:
+        if move.code == hashMove:
+            yield move
+        elif move.pieceCaptured != '--':
+            captures.append(move)
+        else:
+            quiet.append(move)
+    captures.sort(key=mvvLva, reverse=True)
+    yield from captures
+    yield from (move for move in quiet if move.isPawnPromotion)
+    yield from (move for move in quiet if not move.isPawnPromotion)
+
+
+SEE_VALUES = {'P': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 20000, '-': 0}
+
+
+# Result of an exchange on one square: values[0] is taken by the first capture, which is made regardless, and
+# values[d] by the d-th recapture, which the side to move only makes when it doesn't lose by it
+def exchangeValue(values):
+    score = 0
+    for value in reversed(values[1:]):
+        score = max(0, value - score)
+    return values[0] - score
+
+
+# Legal moves of recently seen positions by Zobrist key, so a position that comes back (after an undo, through a
+# transposition in search, on a repetition) costs a lookup instead of a generation. An entry is the tuple of moves and
+# whether the side to move is in check; no moves means checkmate when in check and stalemate otherwise. makeMove and
+# undoMove keep zobristKey in step with the position, so a changed position is just another key and no entry ever
+# has to be invalidated. The least recently used entries are dropped once there are more than maxEntries or their
+# estimated size passes maxBytes. Set it as state.moveCache to use it. Entries hold the Move objects of the backend
+# that generated them, so give each backend its own cache.
+class MoveCache:
+    ENTRY_BYTES = 200  # ordered dict node, key and entry tuple; the tuple of moves is measured with sys.getsizeof
+
+    def __init__(self, maxEntries=100000, maxBytes=32 << 20):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    # The (moves, inCheck) entry for key, or None
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, moves, inCheck):
+        entry = (tuple(moves), inCheck)
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= self.entrySize(old)
+        self.entries[key] = entry
+        self.bytes += self.entrySize(entry)
+        while len(self.entries) > self.maxEntries or self.bytes > self.maxBytes:
+            self.bytes -= self.entrySize(self.entries.popitem(last=False)[1])
+            self.evictions += 1
+        return entry
+
+    def entrySize(self, entry):
+        return self.ENTRY_BYTES + sys.getsizeof(entry[0])
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hitRate": self.hitRate()}
+
+
 class GameState:
-    def __init__(self):
+    moveCache = None  # a MoveCache consulted by getValidMoves, off by default
+    debugZobrist = False  # recompute the key from scratch after every move and compare
+    debugEvaluation = False  # same for the incremental evaluation terms
+    def __init__(self, fen=None):
         self.board = [
             ['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR'],
             ['bP', 'bP', 'bP', 'bP', 'bP', 'bP', 'bP', 'bP'],
@@ -28,11 +212,141 @@ class GameState:
         self.currentCastling = Castling(True, True, True, True)
         self.castlingLog = [Castling(self.currentCastling.wks, self.currentCastling.bks,
                                      self.currentCastling.wqs, self.currentCastling.bqs)]
+        self.baseHalfmove = 0
+        self.baseFullmove = 1
+        if fen is not None:
+            self.loadFEN(fen)
+        self.zobristKey = self.computeZobrist()
+        self.zobristLog = [self.zobristKey]
+        self.evalTerms = self.computeEvalTerms()
+        self.evalLog = [self.evalTerms]
+        self.buildPieceLists()
+
+    # Sets up the position described by a FEN string
+    def loadFEN(self, fen):
+        fields = fen.split()
+        self.board = []
+        for rank in fields[0].split('/'):
+            row = []
+            for ch in rank:
+                if ch.isdigit():
+                    row.extend(['--'] * int(ch))
+                else:
+                    row.append(('w' if ch.isupper() else 'b') + ch.upper())
+            self.board.append(row)
+        self.whiteMoves = len(fields) < 2 or fields[1] == 'w'
+        rights = fields[2] if len(fields) > 2 else '-'
+        self.currentCastling = Castling('K' in rights, 'k' in rights, 'Q' in rights, 'q' in rights)
+        self.enpassant = ()
+        if len(fields) > 3 and fields[3] != '-':
+            self.enpassant = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        self.baseHalfmove = int(fields[4]) if len(fields) > 4 else 0
+        self.baseFullmove = int(fields[5]) if len(fields) > 5 else 1
+        self.positionLoaded()
+
+    def getFEN(self):
+        return toFEN(self)
+
+    def toBytes(self):
+        return packSnapshot([piece for row in self.board for piece in row], self.whiteMoves,
+                            castlingIndex(self.currentCastling),
+                            self.enpassant[0] * 8 + self.enpassant[1] if self.enpassant != () else -1,
+                            *moveClocks(self))
+
+    # Sets up the position in a snapshot made by toBytes
+    def loadBytes(self, data):
+        squares, flags, enpassant, self.baseHalfmove, self.baseFullmove = SNAPSHOT.unpack(data)
+        self.board = [[SNAPSHOT_PIECES[code] for code in squares[row * 8:row * 8 + 8]] for row in range(8)]
+        self.whiteMoves = not flags & 1
+        self.currentCastling = Castling(bool(flags & 2), bool(flags & 8), bool(flags & 4), bool(flags & 16))
+        self.enpassant = divmod(enpassant, 8) if enpassant < 64 else ()
+        self.positionLoaded()
+
+    @classmethod
+    def fromBytes(cls, data):
+        state = cls.__new__(cls)  # skips setting up the start position only to replace it
+        state.moveFunctions = {"P": state.getPawnMoves, "R": state.getRookMoves, "B": state.getBishopMoves,
+                               "N": state.getKnightMoves, "K": state.getKingMoves, "Q": state.getQueenMoves}
+        state.loadBytes(data)
+        return state
+
+    # A copy of the position without its move history, so it can't be undone past this point
+    def clone(self):
+        return self.fromBytes(self.toBytes())
+
+    # Finds the kings, clears the history and recomputes the key and piece lists after a new position was set up
+    def positionLoaded(self):
+        for x in range(8):
+            for y in range(8):
+                if self.board[x][y] == 'wK':
+                    self.wKing = (x, y)
+                elif self.board[x][y] == 'bK':
+                    self.bKing = (x, y)
+        self.castlingLog = [Castling(self.currentCastling.wks, self.currentCastling.bks,
+                                     self.currentCastling.wqs, self.currentCastling.bqs)]
+        self.enpassantLog = [self.enpassant]
+        self.moveLog = []
+        self.inCheck = False
+        self.checks = []
+        self.pins = []
+        self.checkmate = False
+        self.stalemate = False
+        self.zobristKey = self.computeZobrist()
+        self.zobristLog = [self.zobristKey]
+        self.evalTerms = self.computeEvalTerms()
+        self.evalLog = [self.evalTerms]
+        self.buildPieceLists()
+
+    # Squares occupied by each color and the number of each piece, kept up to date by makeMove and undoMove so move
+    # generation only visits occupied squares
+    def buildPieceLists(self):
+        self.pieceSquares = {'w': set(), 'b': set()}
+        self.pieceCounts = {color + piece: 0 for color in 'wb' for piece in 'PNBRQK'}
+        for x in range(8):
+            for y in range(8):
+                piece = self.board[x][y]
+                if piece != '--':
+                    self.pieceSquares[piece[0]].add((x, y))
+                    self.pieceCounts[piece] += 1
+
+    def computeZobrist(self):
+        key = 0
+        for x in range(8):
+            for y in range(8):
+                key ^= ZOBRIST_PIECES[self.board[x][y]][x * 8 + y]
+        key ^= ZOBRIST_CASTLING[castlingIndex(self.currentCastling)]
+        if self.enpassant != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassant[1]]
+        if not self.whiteMoves:
+            key ^= ZOBRIST_SIDE
+        return key
+
+    def checkZobrist(self):
+        if self.zobristKey != self.computeZobrist():
+            raise AssertionError("Zobrist key out of sync after " + " ".join(m.getNotation() for m in self.moveLog))
+
+    def computeEvalTerms(self):
+        return evalTerms([piece for row in self.board for piece in row])
+
+    def checkEvaluation(self):
+        if self.evalTerms != self.computeEvalTerms():
+            raise AssertionError("Evaluation out of sync after " + " ".join(m.getNotation() for m in self.moveLog))
+
+    # Tapered material and piece-square score (Evaluation.py) from the side to move's point of view
+    def evaluation(self):
+        return taperedScore(self.evalTerms, self.whiteMoves)
 
     def makeMove(self, move):
+        oldRights = castlingIndex(self.currentCastling)
+        oldEnpassant = self.enpassant
+        capturedSquare = move.endR * 8 + move.endC
+        rookSquares = ()
         self.board[move.startR][move.startC] = '--'
         self.board[move.endR][move.endC] = move.pieceMoved
         self.moveLog.append(move)
+        ownSquares = self.pieceSquares[move.pieceMoved[0]]
+        ownSquares.remove((move.startR, move.startC))
+        ownSquares.add((move.endR, move.endC))
         self.whiteMoves = not self.whiteMoves
         if move.pieceMoved == "wK":
             self.wKing = (move.endR, move.endC)
@@ -42,24 +356,33 @@ class GameState:
         # Pawn promotion
         if move.isPawnPromotion:
             self.board[move.endR][move.endC] = move.pieceMoved[0] + 'Q'
+            self.pieceCounts[move.pieceMoved] -= 1
+            self.pieceCounts[move.pieceMoved[0] + 'Q'] += 1
 
         # Castle move
         if move.pieceMoved[1] == 'K' and abs(move.endC - move.startC) > 1:
             if move.endC - move.startC == 2: # king side
-                print(self.board[move.endR][move.endC+1])
                 self.board[move.endR][move.endC-1] = self.board[move.endR][move.endC+1]
                 self.board[move.endR][move.endC+1] = '--'
+                rookSquares = (move.endR * 8 + move.endC + 1, move.endR * 8 + move.endC - 1)
             else: # queen side
                 self.board[move.endR][move.endC+1] = self.board[move.endR][move.endC-2]
                 self.board[move.endR][move.endC-2] = '--'
+                rookSquares = (move.endR * 8 + move.endC - 2, move.endR * 8 + move.endC + 1)
+            ownSquares.remove(divmod(rookSquares[0], 8))
+            ownSquares.add(divmod(rookSquares[1], 8))
 
         # update castling
         self.updateCastleRights(move)
         self.castlingLog.append(Castling(self.currentCastling.wks, self.currentCastling.bks, self.currentCastling.wqs, self.currentCastling.bqs))
         # En passant
-        if (move.endR, move.endC) == self.enpassantLog[-1]:
+        if move.pieceMoved[1] == 'P' and (move.endR, move.endC) == self.enpassantLog[-1]:
             move.pieceCaptured = self.board[move.startR][move.endC]
             self.board[move.startR][move.endC] = '--'
+            capturedSquare = move.startR * 8 + move.endC
+        if move.pieceCaptured != '--':
+            self.pieceSquares[move.pieceCaptured[0]].remove(divmod(capturedSquare, 8))
+            self.pieceCounts[move.pieceCaptured] -= 1
 
         # Update enpassant variable
         if move.pieceMoved[1] == 'P' and abs(move.startR - move.endR) == 2:
@@ -68,11 +391,52 @@ class GameState:
             self.enpassant = ()
         self.enpassantLog.append(self.enpassant)
 
+        # Update the Zobrist key with everything that changed
+        key = self.zobristKey ^ ZOBRIST_SIDE
+        key ^= ZOBRIST_PIECES[move.pieceMoved][move.startR * 8 + move.startC]
+        key ^= ZOBRIST_PIECES[self.board[move.endR][move.endC]][move.endR * 8 + move.endC]
+        key ^= ZOBRIST_PIECES[move.pieceCaptured][capturedSquare]
+        if rookSquares:
+            rook = move.pieceMoved[0] + 'R'
+            key ^= ZOBRIST_PIECES[rook][rookSquares[0]] ^ ZOBRIST_PIECES[rook][rookSquares[1]]
+        key ^= ZOBRIST_CASTLING[oldRights] ^ ZOBRIST_CASTLING[castlingIndex(self.currentCastling)]
+        if oldEnpassant != ():
+            key ^= ZOBRIST_ENPASSANT[oldEnpassant[1]]
+        if self.enpassant != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassant[1]]
+        self.zobristKey = key
+        self.zobristLog.append(key)
+        if self.debugZobrist:
+            self.checkZobrist()
+
+        # And the evaluation terms
+        start = move.startR * 8 + move.startC
+        end = move.endR * 8 + move.endC
+        placed = self.board[move.endR][move.endC]
+        mg, eg, phase = self.evalTerms
+        mg += PSQT_MG[placed][end] - PSQT_MG[move.pieceMoved][start] - PSQT_MG[move.pieceCaptured][capturedSquare]
+        eg += PSQT_EG[placed][end] - PSQT_EG[move.pieceMoved][start] - PSQT_EG[move.pieceCaptured][capturedSquare]
+        phase += PHASE[placed] - PHASE[move.pieceMoved] - PHASE[move.pieceCaptured]
+        if rookSquares:
+            rook = move.pieceMoved[0] + 'R'
+            mg += PSQT_MG[rook][rookSquares[1]] - PSQT_MG[rook][rookSquares[0]]
+            eg += PSQT_EG[rook][rookSquares[1]] - PSQT_EG[rook][rookSquares[0]]
+        self.evalTerms = (mg, eg, phase)
+        self.evalLog.append(self.evalTerms)
+        if self.debugEvaluation:
+            self.checkEvaluation()
+
     def undoMove(self):
         if len(self.moveLog) != 0:
             move = self.moveLog.pop()
             self.board[move.startR][move.startC] = move.pieceMoved
             self.board[move.endR][move.endC] = move.pieceCaptured
+            ownSquares = self.pieceSquares[move.pieceMoved[0]]
+            ownSquares.remove((move.endR, move.endC))
+            ownSquares.add((move.startR, move.startC))
+            if move.isPawnPromotion:
+                self.pieceCounts[move.pieceMoved] += 1
+                self.pieceCounts[move.pieceMoved[0] + 'Q'] -= 1
             self.whiteMoves = not self.whiteMoves
             if move.pieceMoved == "wK":
                 self.wKing = (move.startR, move.startC)
@@ -80,26 +444,56 @@ class GameState:
                 self.bKing = (move.startR, move.startC)
             # undo castling rights
             self.castlingLog.pop()
-            self.currentCastling = self.castlingLog[-1]
+            rights = self.castlingLog[-1]
+            self.currentCastling = Castling(rights.wks, rights.bks, rights.wqs, rights.bqs)
 
             # Undo Castle move
             if move.pieceMoved[1] == 'K' and abs(move.endC - move.startC) > 1:
                 if move.endC - move.startC == 2:
                     self.board[move.endR][move.endC + 1] = self.board[move.endR][move.endC - 1]
                     self.board[move.endR][move.endC - 1] = '--'
+                    ownSquares.remove((move.endR, move.endC - 1))
+                    ownSquares.add((move.endR, move.endC + 1))
                 else:
                     self.board[move.endR][move.endC - 2] = self.board[move.endR][move.endC + 1]
                     self.board[move.endR][move.endC + 1] = '--'
+                    ownSquares.remove((move.endR, move.endC + 1))
+                    ownSquares.add((move.endR, move.endC - 2))
 
             # Undo en passant
             self.enpassantLog.pop()
             self.enpassant = self.enpassantLog[-1]
 
-            if (move.endR, move.endC) == self.enpassant:
+            capturedSquare = (move.endR, move.endC)
+            if move.pieceMoved[1] == 'P' and (move.endR, move.endC) == self.enpassant:
                 self.board[move.endR][move.endC] = '--'
                 self.board[move.startR][move.endC] = move.pieceCaptured
+                capturedSquare = (move.startR, move.endC)
+            if move.pieceCaptured != '--':
+                self.pieceSquares[move.pieceCaptured[0]].add(capturedSquare)
+                self.pieceCounts[move.pieceCaptured] += 1
+
+            self.zobristLog.pop()
+            self.zobristKey = self.zobristLog[-1]
+            self.evalLog.pop()
+            self.evalTerms = self.evalLog[-1]
+            if self.debugZobrist:
+                self.checkZobrist()
+            if self.debugEvaluation:
+                self.checkEvaluation()
 
     def updateCastleRights(self, move):
+        # a rook captured on its home square loses its castling right too
+        if move.pieceCaptured == 'wR' and move.endR == 7:
+            if move.endC == 0:
+                self.currentCastling.wqs = False
+            elif move.endC == 7:
+                self.currentCastling.wks = False
+        elif move.pieceCaptured == 'bR' and move.endR == 0:
+            if move.endC == 0:
+                self.currentCastling.bqs = False
+            elif move.endC == 7:
+                self.currentCastling.bks = False
         if move.pieceMoved == 'wK':
             self.currentCastling.wks = False
             self.currentCastling.wqs = False
@@ -120,6 +514,15 @@ class GameState:
                     self.currentCastling.bks = False
 
     def getValidMoves(self):
+        if self.moveCache is None:
+            return self.generateValidMoves()
+        entry = self.moveCache.get(self.zobristKey)
+        if entry is None:
+            entry = self.moveCache.put(self.zobristKey, self.generateValidMoves(), self.inCheck)
+        self.inCheck = entry[1]
+        return list(entry[0])
+
+    def generateValidMoves(self):
         moves = []
         self.inCheck, self.pins, self.checks = self.pinsAndChecks()
         if self.whiteMoves:
@@ -129,27 +532,9 @@ class GameState:
             kingRow = self.bKing[0]
             kingCol = self.bKing[1]
         if self.inCheck:
+            self.getKingMoves(kingRow, kingCol, moves)
             if len(self.checks) == 1:
-                moves = self.getPossibleMoves()
-                check = self.checks[0]
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol]
-                validSquares = []
-                if pieceChecking[1] == 'N':
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    for i in range(1, 8):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i)
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol:
-                            break
-                for k in range(len(moves)-1, -1, -1):
-                    if moves[k].pieceMoved[1] != 'K':
-                        if not (moves[k].endR, moves[k].endC) in validSquares:
-                            moves.remove(moves[k])
-            else:
-                self.getKingMoves(kingRow, kingCol, moves)
+                self.getEvasionMoves(kingRow, kingCol, self.checks[0], moves)
         else:
             moves = self.getPossibleMoves()
             if self.whiteMoves:
@@ -158,6 +543,224 @@ class GameState:
                 self.getCastleMoves(self.bKing[0], self.bKing[1], moves, 'b')
         return moves
 
+    # Yields the legal moves in stages, computing each stage only when the caller asks for more: the hash move (a
+    # Move.code from a previous search), captures by MVV-LVA, quiet promotions, then the remaining quiet moves.
+    # In check the (already short) evasion list is generated at once and yielded in the same order.
+    def getStagedMoves(self, hashMove=None):
+        self.inCheck, pins, self.checks = self.pinsAndChecks()
+        if self.inCheck:
+            moves = self.getValidMoves()
+            moves.sort(key=lambda m: (m.code != hashMove, m.pieceCaptured == '--',
+                                      -mvvLva(m) if m.pieceCaptured != '--' else not m.isPawnPromotion))
+            yield from moves
+            return
+        pinned = {(pin[0], pin[1]): (pin[2], pin[3]) for pin in pins}
+
+        if hashMove is not None:
+            move = self.findPieceMove(hashMove, pins)
+            if move is not None:
+                yield move
+
+        captures = []
+        self.getCaptureMoves(captures, pinned)
+        captures.sort(key=mvvLva, reverse=True)
+        for move in captures:
+            if move.code != hashMove:
+                yield move
+
+        promotions = []
+        self.getQuietPromotions(promotions, pinned)
+        for move in promotions:
+            if move.code != hashMove:
+                yield move
+
+        quiet = []
+        self.getQuietMoves(quiet, pinned)
+        for move in quiet:
+            if move.code != hashMove:
+                yield move
+
+    # The legal move with this code, generated from its piece alone, or None if there is none
+    def findPieceMove(self, code, pins):
+        x, y = divmod(code & 63, 8)
+        piece = self.board[x][y]
+        if piece == '--' or (piece[0] == 'w') != self.whiteMoves:
+            return None
+        moves = []
+        self.pins = list(pins)
+        if code >> 12 & CASTLE:
+            if piece[1] == 'K' and (x, y) == ((7, 4) if self.whiteMoves else (0, 4)):
+                self.getCastleMoves(x, y, moves, piece[0])
+        else:
+            self.moveFunctions[piece[1]](x, y, moves)
+        for move in moves:
+            if move.code == code:
+                return move
+        return None
+
+    # Legal captures (including en passant and capturing promotions) when not in check. pinned maps each pinned
+    # square to the direction of its pin.
+    def getCaptureMoves(self, moves, pinned):
+        board = self.board
+        allyColor = 'w' if self.whiteMoves else 'b'
+        enemyColor = 'b' if self.whiteMoves else 'w'
+        for (x, y) in self.pieceSquares[allyColor]:
+            piece = board[x][y][1]
+            pin = pinned.get((x, y))
+            if piece == 'N':
+                if pin is None:
+                    for (i, j) in KNIGHT_STEPS:
+                        if 0 <= x + i <= 7 and 0 <= y + j <= 7 and board[x + i][y + j][0] == enemyColor:
+                            moves.append(sharedMove(x, y, x + i, y + j, board))
+            elif piece == 'P':
+                forward = -1 if allyColor == 'w' else 1
+                for j in (-1, 1):
+                    if 0 <= y + j <= 7 and (pin is None or pin == (forward, j)):
+                        if board[x + forward][y + j][0] == enemyColor:
+                            moves.append(sharedMove(x, y, x + forward, y + j, board))
+                        elif (x + forward, y + j) == self.enpassant and not self.enpassantExposesKing(x, y, y + j):
+                            moves.append(Move((x, y), (x + forward, y + j), board, isEnpassant=True))
+            elif piece == 'K':
+                board[x][y] = '--'
+                for (i, j), sliders in RAY_ATTACKERS:
+                    if 0 <= x + i <= 7 and 0 <= y + j <= 7 and board[x + i][y + j][0] == enemyColor and \
+                            not self.isAttacked(x + i, y + j, enemyColor):
+                        board[x][y] = allyColor + 'K'
+                        moves.append(sharedMove(x, y, x + i, y + j, board))
+                        board[x][y] = '--'
+                board[x][y] = allyColor + 'K'
+            else:
+                for (i, j), sliders in RAY_ATTACKERS:
+                    if piece not in sliders or (pin is not None and pin != (i, j) and pin != (-i, -j)):
+                        continue
+                    endRow = x + i
+                    endCol = y + j
+                    while 0 <= endRow <= 7 and 0 <= endCol <= 7:
+                        target = board[endRow][endCol]
+                        if target != '--':
+                            if target[0] == enemyColor:
+                                moves.append(sharedMove(x, y, endRow, endCol, board))
+                            break
+                        endRow += i
+                        endCol += j
+
+    # Pawn pushes onto the last rank, the promotions that don't capture
+    def getQuietPromotions(self, moves, pinned):
+        allyColor = 'w' if self.whiteMoves else 'b'
+        row, forward = (1, -1) if allyColor == 'w' else (6, 1)
+        for y in range(8):
+            if self.board[row][y] == allyColor + 'P' and self.board[row + forward][y] == '--':
+                pin = pinned.get((row, y))
+                if pin is None or pin[1] == 0:
+                    moves.append(sharedMove(row, y, row + forward, y, self.board))
+
+    # Legal moves that neither capture nor promote (castling included) when not in check, the last stage of
+    # getStagedMoves. pinned is the same map as for getCaptureMoves.
+    def getQuietMoves(self, moves, pinned):
+        board = self.board
+        allyColor = 'w' if self.whiteMoves else 'b'
+        enemyColor = 'b' if self.whiteMoves else 'w'
+        for (x, y) in list(self.pieceSquares[allyColor]):
+            piece = board[x][y][1]
+            pin = pinned.get((x, y))
+            if piece == 'N':
+                if pin is None:
+                    for (i, j) in KNIGHT_STEPS:
+                        if 0 <= x + i <= 7 and 0 <= y + j <= 7 and board[x + i][y + j] == '--':
+                            moves.append(sharedMove(x, y, x + i, y + j, board))
+            elif piece == 'P':
+                forward, startRow = (-1, 6) if allyColor == 'w' else (1, 1)
+                if (pin is None or pin[1] == 0) and board[x + forward][y] == '--' and 0 < x + forward < 7:
+                    moves.append(sharedMove(x, y, x + forward, y, board))
+                    if x == startRow and board[x + 2 * forward][y] == '--':
+                        moves.append(sharedMove(x, y, x + 2 * forward, y, board))
+            elif piece == 'K':
+                board[x][y] = '--'
+                for (i, j), sliders in RAY_ATTACKERS:
+                    if 0 <= x + i <= 7 and 0 <= y + j <= 7 and board[x + i][y + j] == '--' and \
+                            not self.isAttacked(x + i, y + j, enemyColor):
+                        board[x][y] = allyColor + 'K'
+                        moves.append(sharedMove(x, y, x + i, y + j, board))
+                        board[x][y] = '--'
+                board[x][y] = allyColor + 'K'
+                self.getCastleMoves(x, y, moves, allyColor)
+            else:
+                for (i, j), sliders in RAY_ATTACKERS:
+                    if piece not in sliders or (pin is not None and pin != (i, j) and pin != (-i, -j)):
+                        continue
+                    endRow = x + i
+                    endCol = y + j
+                    while 0 <= endRow <= 7 and 0 <= endCol <= 7 and board[endRow][endCol] == '--':
+                        moves.append(sharedMove(x, y, endRow, endCol, board))
+                        endRow += i
+                        endCol += j
+
+    # Captures and promotions, best victims first, for quiescence search. Every legal move when in check.
+    def getTacticalMoves(self):
+        self.inCheck, pins, self.checks = self.pinsAndChecks()
+        if self.inCheck:
+            return self.getValidMoves()
+        pinned = {(pin[0], pin[1]): (pin[2], pin[3]) for pin in pins}
+        moves = []
+        self.getCaptureMoves(moves, pinned)
+        moves.sort(key=mvvLva, reverse=True)
+        self.getQuietPromotions(moves, pinned)
+        return moves
+
+    # Static exchange evaluation: the material the side to move wins by playing move and then letting both sides keep
+    # recapturing on its end square with their least valuable attacker, each free to stop. Worked out on the board as
+    # it is (pieces that have recaptured are skipped, which uncovers x-rays behind them) without making any move. Pins
+    # are ignored.
+    def see(self, move):
+        values = [SEE_VALUES[move.pieceCaptured[1]]]
+        onSquare = SEE_VALUES[move.pieceMoved[1]]
+        if move.isPawnPromotion:
+            values[0] += SEE_VALUES['Q'] - SEE_VALUES['P']
+            onSquare = SEE_VALUES['Q']
+        removed = {(move.startR, move.startC)}
+        if move.isEnpassantMove:
+            removed.add((move.startR, move.endC))
+        color = 'b' if move.pieceMoved[0] == 'w' else 'w'
+        while True:
+            attacker = self.leastValuableAttacker(move.endR, move.endC, color, removed)
+            if attacker is None:
+                break
+            values.append(onSquare)
+            onSquare, square = attacker
+            removed.add(square)
+            color = 'b' if color == 'w' else 'w'
+        return exchangeValue(values)
+
+    # (value, square) of the cheapest piece of color attacking (x, y), treating the squares in removed as empty. Of
+    # equally cheap attackers the one on the lowest square (row * 8 + col) goes first, the same one BitboardState.see
+    # picks, since which one goes first decides the x-rays it uncovers.
+    def leastValuableAttacker(self, x, y, color, removed):
+        board = self.board
+        pawnRow = x + 1 if color == 'w' else x - 1
+        if 0 <= pawnRow <= 7:
+            for j in (-1, 1):
+                if 0 <= y + j <= 7 and board[pawnRow][y + j] == color + 'P' and (pawnRow, y + j) not in removed:
+                    return SEE_VALUES['P'], (pawnRow, y + j)
+        knights = [(x + i, y + j) for (i, j) in KNIGHT_STEPS if 0 <= x + i <= 7 and 0 <= y + j <= 7 and
+                   board[x + i][y + j] == color + 'N' and (x + i, y + j) not in removed]
+        if knights:
+            return SEE_VALUES['N'], min(knights)
+        best = None
+        for (i, j), sliders in RAY_ATTACKERS:
+            endRow = x + i
+            endCol = y + j
+            while 0 <= endRow <= 7 and 0 <= endCol <= 7:
+                piece = board[endRow][endCol]
+                if piece != '--' and (endRow, endCol) not in removed:
+                    if piece[0] == color and (piece[1] in sliders or
+                                              (piece[1] == 'K' and endRow == x + i and endCol == y + j)):
+                        if best is None or (SEE_VALUES[piece[1]], (endRow, endCol)) < best:
+                            best = (SEE_VALUES[piece[1]], (endRow, endCol))
+                    break
+                endRow += i
+                endCol += j
+        return best
+
     def inBound(self, x, y):
         return 0 <= x <= 7 and 0 <= y <= 7
 
@@ -218,35 +821,86 @@ class GameState:
 
     def getPossibleMoves(self):
         moves = []
-        for x in range(0, 8):
-            for y in range(0, 8):
-                color = self.board[x][y][0]
-                if (color == 'w' and self.whiteMoves) or (color == 'b' and not self.whiteMoves):
-                    piece = self.board[x][y][1]
-                    self.moveFunctions[piece](x, y, moves)
+        for (x, y) in self.pieceSquares['w' if self.whiteMoves else 'b']:
+            self.moveFunctions[self.board[x][y][1]](x, y, moves)
         return moves
 
     def getKingMoves(self, x, y, moves):
         coordinates = [[-1, 0], [0, -1], [0, 1], [1, 0], [-1, 1], [1, -1], [-1, -1], [1, 1]]
-        color = self.board[x][y][0]
+        king = self.board[x][y]
+        color = king[0]
+        enemyColor = 'b' if color == 'w' else 'w'
+        # the king is lifted off the board so a slider checking it along a line still covers the squares behind it
+        self.board[x][y] = '--'
         for (i, j) in coordinates:
             if self.inBound(x + i, y + j):
                 endPiece = self.board[x+i][y+j]
-                if endPiece[0] != color:
-                    if color == 'w':
-                        self.wKing = (x+i, y+j)
-                    else:
-                        self.bKing = (x+i, y+j)
-                    inCheck, pins, checks = self.pinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((x, y), (x + i, y + j), self.board))
-                    if color == 'w':
-                        self.wKing = (x, y)
-                    else:
-                        self.bKing = (x, y)
+                if endPiece[0] != color and not self.isAttacked(x + i, y + j, enemyColor):
+                    self.board[x][y] = king
+                    moves.append(sharedMove(x, y, x + i, y + j, self.board))
+                    self.board[x][y] = '--'
+        self.board[x][y] = king
+
+    # Non king answers to a single check: capturing the checker or blocking the line between it and the king.
+    # Only pieces that can reach one of those squares are looked at, pinned pieces can never help.
+    def getEvasionMoves(self, kingRow, kingCol, check, moves):
+        checkRow, checkCol = check[0], check[1]
+        targets = []
+        if self.board[checkRow][checkCol][1] != 'N':
+            for k in range(1, 8):
+                square = (kingRow + check[2] * k, kingCol + check[3] * k)
+                if square == (checkRow, checkCol):
+                    break
+                targets.append(square)
+        targets.append((checkRow, checkCol))
+        allyColor = 'w' if self.whiteMoves else 'b'
+        pinned = {(pin[0], pin[1]) for pin in self.pins}
+        for (x, y) in targets:
+            self.getMovesTo(x, y, allyColor, pinned, moves)
+
+        # A pawn that just moved two squares and gives check can also be taken en passant
+        if self.enpassant != () and self.board[checkRow][checkCol][1] == 'P' and \
+                checkCol == self.enpassant[1] and abs(checkRow - self.enpassant[0]) == 1:
+            for y in (checkCol - 1, checkCol + 1):
+                if 0 <= y <= 7 and self.board[checkRow][y] == allyColor + 'P' and (checkRow, y) not in pinned and \
+                        not self.enpassantExposesKing(checkRow, y, checkCol):
+                    moves.append(Move((checkRow, y), self.enpassant, self.board, isEnpassant=True))
+
+    # Moves of unpinned non king pieces of allyColor that land on (x, y)
+    def getMovesTo(self, x, y, allyColor, pinned, moves):
+        board = self.board
+        for (i, j) in KNIGHT_STEPS:
+            if 0 <= x + i <= 7 and 0 <= y + j <= 7 and board[x + i][y + j] == allyColor + 'N' and \
+                    (x + i, y + j) not in pinned:
+                moves.append(sharedMove(x + i, y + j, x, y, board))
+        for (i, j), sliders in RAY_ATTACKERS:
+            endRow = x + i
+            endCol = y + j
+            while 0 <= endRow <= 7 and 0 <= endCol <= 7:
+                piece = board[endRow][endCol]
+                if piece != '--':
+                    if piece[0] == allyColor and piece[1] in sliders and (endRow, endCol) not in pinned:
+                        moves.append(sharedMove(endRow, endCol, x, y, board))
+                    break
+                endRow += i
+                endCol += j
+        back = 1 if allyColor == 'w' else -1
+        pawn = allyColor + 'P'
+        if not 0 <= x + back <= 7:
+            return
+        if board[x][y] == '--':
+            if board[x + back][y] == pawn and (x + back, y) not in pinned:
+                moves.append(sharedMove(x + back, y, x, y, board))
+            elif board[x + back][y] == '--' and x == (4 if allyColor == 'w' else 3) and \
+                    board[x + 2 * back][y] == pawn and (x + 2 * back, y) not in pinned:
+                moves.append(sharedMove(x + 2 * back, y, x, y, board))
+        else:
+            for col in (y - 1, y + 1):
+                if 0 <= col <= 7 and board[x + back][col] == pawn and (x + back, col) not in pinned:
+                    moves.append(sharedMove(x + back, col, x, y, board))
 
     def getCastleMoves(self, x, y, moves, allyColor):
-        if self.squareUnderAttack(x, y):
+        if self.isAttacked(x, y, 'b' if allyColor == 'w' else 'w'):
             return
         if (self.whiteMoves and self.currentCastling.wks) or (not self.whiteMoves and self.currentCastling.bks):
             self.getKingSideCastle(x, y, moves, allyColor)
@@ -255,27 +909,52 @@ class GameState:
 
     def getKingSideCastle(self, x, y, moves, allyColor):
         if self.board[x][y+1] == '--' and self.board[x][y+2] == '--':
-            if not self.squareUnderAttack(x, y+1) and not self.squareUnderAttack(x, y+2):
+            enemyColor = 'b' if allyColor == 'w' else 'w'
+            if not self.isAttacked(x, y + 1, enemyColor) and not self.isAttacked(x, y + 2, enemyColor):
                 moves.append(Move((x, y), (x, y+2), self.board, isCastleMove=True))
 
     def getQueenSideCastle(self, x, y, moves, allyColor):
         if self.board[x][y - 1] == '--' and self.board[x][y - 2] == '--' and self.board[x][y-3] == '--':
-            if not self.squareUnderAttack(x, y - 1) and not self.squareUnderAttack(x, y - 2):
+            enemyColor = 'b' if allyColor == 'w' else 'w'
+            if not self.isAttacked(x, y - 1, enemyColor) and not self.isAttacked(x, y - 2, enemyColor):
                 moves.append(Move((x, y), (x, y - 2), self.board, isCastleMove=True))
 
     def Check(self):
         if self.whiteMoves:
-            return self.squareUnderAttack(self.wKing[0], self.wKing[1])
+            return self.isAttacked(self.wKing[0], self.wKing[1], 'b')
         else:
-            return self.squareUnderAttack(self.bKing[0], self.bKing[1])
+            return self.isAttacked(self.bKing[0], self.bKing[1], 'w')
 
     def squareUnderAttack(self, x, y):
-        self.whiteMoves = not self.whiteMoves
-        opponentMoves = self.getPossibleMoves()
-        self.whiteMoves = not self.whiteMoves
-        for move in opponentMoves:
-            if move.endR == x and move.endC == y:
+        return self.isAttacked(x, y, 'b' if self.whiteMoves else 'w')
+
+    # Looks outward from (x, y) for a piece of enemyColor that attacks it, without generating any moves
+    def isAttacked(self, x, y, enemyColor):
+        board = self.board
+        for (i, j) in KNIGHT_STEPS:
+            if 0 <= x + i <= 7 and 0 <= y + j <= 7:
+                piece = board[x + i][y + j]
+                if piece[0] == enemyColor and piece[1] == 'N':
+                    return True
+        pawnRow = x + 1 if enemyColor == 'w' else x - 1
+        if 0 <= pawnRow <= 7:
+            if y > 0 and board[pawnRow][y - 1] == enemyColor + 'P':
+                return True
+            if y < 7 and board[pawnRow][y + 1] == enemyColor + 'P':
                 return True
+        for (i, j), sliders in RAY_ATTACKERS:
+            endRow = x + i
+            endCol = y + j
+            if 0 <= endRow <= 7 and 0 <= endCol <= 7 and board[endRow][endCol] == enemyColor + 'K':
+                return True
+            while 0 <= endRow <= 7 and 0 <= endCol <= 7:
+                piece = board[endRow][endCol]
+                if piece != '--':
+                    if piece[0] == enemyColor and piece[1] in sliders:
+                        return True
+                    break
+                endRow += i
+                endCol += j
         return False
 
     def getQueenMoves(self, x, y, moves):
@@ -294,7 +973,7 @@ class GameState:
             if self.inBound(x+i, y+j):
                 if not pinned:
                     if self.board[x + i][y + j][0] != self.board[x][y][0]:
-                        moves.append(Move((x, y), (x+i, y+j), self.board))
+                        moves.append(sharedMove(x, y, x+i, y+j, self.board))
 
     def getRookMoves(self, x, y, moves):
         pinned = False
@@ -313,7 +992,7 @@ class GameState:
                     if not pinned or direction == (i, j) or direction == (-i, -j):
                         if self.board[x + k * i][y + k * j][0] == self.board[x][y][0]:
                             break
-                        moves.append(Move((x, y), (x + k * i, y + k * j), self.board))
+                        moves.append(sharedMove(x, y, x + k * i, y + k * j, self.board))
                         if self.board[x + k * i][y + k * j] != "--":
                             break
                 else:
@@ -335,7 +1014,7 @@ class GameState:
                     if not pinned or direction == (i, j) or direction == (-i, -j):
                         if self.board[x + k * i][y + k * j][0] == self.board[x][y][0]:
                             break
-                        moves.append(Move((x, y), (x + k * i, y + k * j), self.board))
+                        moves.append(sharedMove(x, y, x + k * i, y + k * j, self.board))
                         if self.board[x + k * i][y + k * j] != "--":
                             break
                 else:
@@ -352,41 +1031,57 @@ class GameState:
                 break
         if self.whiteMoves:
             if self.board[x - 1][y] == '--':
-                if not pinned or direction == (-1, 0):
-                    moves.append(Move((x, y), (x - 1, y), self.board))
+                if not pinned or direction[1] == 0:
+                    moves.append(sharedMove(x, y, x - 1, y, self.board))
                     if x == 6 and self.board[x - 2][y] == '--':
-                        moves.append(Move((x, y), (x - 2, y), self.board))
+                        moves.append(sharedMove(x, y, x - 2, y, self.board))
             if y - 1 >= 0:
                 if not pinned or direction == (-1, -1):
                     if self.board[x - 1][y - 1][0] == 'b':
-                        moves.append(Move((x, y), (x - 1, y - 1), self.board))
-                    elif (x-1, y-1) == self.enpassant:
+                        moves.append(sharedMove(x, y, x - 1, y - 1, self.board))
+                    elif (x-1, y-1) == self.enpassant and not self.enpassantExposesKing(x, y, y - 1):
                         moves.append(Move((x, y), (x - 1, y - 1), self.board, isEnpassant=True))
             if y + 1 <= 7:
                 if not pinned or direction == (-1, 1):
                     if self.board[x - 1][y + 1][0] == 'b':
-                        moves.append(Move((x, y), (x - 1, y + 1), self.board))
-                    elif (x-1, y+1) == self.enpassant:
+                        moves.append(sharedMove(x, y, x - 1, y + 1, self.board))
+                    elif (x-1, y+1) == self.enpassant and not self.enpassantExposesKing(x, y, y + 1):
                         moves.append(Move((x, y), (x - 1, y + 1), self.board, isEnpassant=True))
         else:
             if self.board[x + 1][y] == '--':
-                if not pinned or direction == (1, 0):
-                    moves.append(Move((x, y), (x + 1, y), self.board))
+                if not pinned or direction[1] == 0:
+                    moves.append(sharedMove(x, y, x + 1, y, self.board))
                     if x == 1 and self.board[x + 2][y] == '--':
-                        moves.append(Move((x, y), (x + 2, y), self.board))
+                        moves.append(sharedMove(x, y, x + 2, y, self.board))
             if y + 1 <= 7:
                 if not pinned or direction == (1, 1):
                     if self.board[x + 1][y + 1][0] == 'w':
-                        moves.append(Move((x, y), (x + 1, y + 1), self.board))
-                    elif (x+1, y+1) == self.enpassant:
+                        moves.append(sharedMove(x, y, x + 1, y + 1, self.board))
+                    elif (x+1, y+1) == self.enpassant and not self.enpassantExposesKing(x, y, y + 1):
                         moves.append(Move((x, y), (x + 1, y + 1), self.board, isEnpassant=True))
             if y - 1 >= 0:
                 if not pinned or direction == (1, -1):
                     if self.board[x + 1][y - 1][0] == 'w':
-                        moves.append(Move((x, y), (x + 1, y - 1), self.board))
-                    elif (x+1, y-1) == self.enpassant:
+                        moves.append(sharedMove(x, y, x + 1, y - 1, self.board))
+                    elif (x+1, y-1) == self.enpassant and not self.enpassantExposesKing(x, y, y - 1):
                         moves.append(Move((x, y), (x + 1, y - 1), self.board, isEnpassant=True))
 
+    # An en passant capture removes two pawns from the same row at once, which the pin scan can't see
+    def enpassantExposesKing(self, x, y, capturedCol):
+        kingRow, kingCol = self.wKing if self.whiteMoves else self.bKing
+        if kingRow != x:
+            return False
+        enemyColor = 'b' if self.whiteMoves else 'w'
+        step = 1 if capturedCol > kingCol else -1
+        col = kingCol + step
+        while 0 <= col <= 7:
+            if col != y and col != capturedCol:
+                piece = self.board[x][col]
+                if piece != '--':
+                    return piece[0] == enemyColor and piece[1] in ('R', 'Q')
+            col += step
+        return False
+
 
 class Castling:
     def __init__(self, wks, bks, wqs, bqs):
@@ -396,9 +1091,16 @@ class Castling:
         self.bqs = bqs
 
 
+# Move flags packed into bits 12-14 of Move.code, above the 6-bit start and end squares
+PROMOTION, ENPASSANT, CASTLE = 1, 2, 4
+
+
 class Move:
-    ranksToRows = {'1': 0, '2': 1, '3': 2, '4': 3,
-                   '5': 4, '6': 5, '7': 6, '8': 7}
+    __slots__ = ('startR', 'startC', 'endR', 'endC', 'pieceMoved', 'pieceCaptured', 'isPawnPromotion',
+                 'isEnpassantMove', 'isCastleMove', 'moveID', 'code')
+
+    ranksToRows = {'1': 7, '2': 6, '3': 5, '4': 4,
+                   '5': 3, '6': 2, '7': 1, '8': 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
     filesToCols = {'a': 0, 'b': 1, 'c': 2, 'd': 3,
                    'e': 4, 'f': 5, 'g': 6, 'h': 7}
@@ -420,6 +1122,9 @@ class Move:
         # Castle move
         self.isCastleMove = isCastleMove
         self.moveID = start[0] * 1000 + start[1] * 100 + end[0] * 10 + end[1]
+        self.code = encodeMove(start[0] * 8 + start[1], end[0] * 8 + end[1],
+                               (PROMOTION if self.isPawnPromotion else 0) | (ENPASSANT if isEnpassant else 0) |
+                               (CASTLE if isCastleMove else 0))
 
     def __eq__(self, other):
         if isinstance(other, Move):
@@ -430,3 +1135,32 @@ class Move:
         start = self.colsToFiles[self.startC] + self.rowsToRanks[self.startR]
         end = self.colsToFiles[self.endC] + self.rowsToRanks[self.endR]
         return start + end
+
+
+# A move as a 15-bit int: start square, end square (row * 8 + col) and flags. Search code can store and compare these
+# instead of Move objects, and decodeMove rebuilds the full Move for the position when the UI needs one.
+def encodeMove(start, end, flags=0):
+    return start | end << 6 | flags << 12
+
+
+def decodeMove(code, board):
+    start = code & 63
+    end = (code >> 6) & 63
+    flags = code >> 12
+    return Move(divmod(start, 8), divmod(end, 8), board, isEnpassant=bool(flags & ENPASSANT),
+                isCastleMove=bool(flags & CASTLE))
+
+
+# Ordinary moves are immutable, so each (start, end, piece moved, piece captured) move is created once and then
+# shared by every position that generates it. MOVE_TABLE[start][end] maps pieceMoved + pieceCaptured to the move.
+MOVE_TABLE = [[{} for _ in range(64)] for _ in range(64)]
+
+
+def sharedMove(startR, startC, endR, endC, board):
+    moved = board[startR][startC]
+    captured = board[endR][endC]
+    byPieces = MOVE_TABLE[startR * 8 + startC][endR * 8 + endC]
+    move = byPieces.get(moved + captured)
+    if move is None:
+        move = byPieces[moved + captured] = Move((startR, startC), (endR, endC), board)
+    return move
@@ -1,6 +1,7 @@
 import pygame as p
 from ChessEngine import *
 from AI import *
+from Bitboard import BitboardState
 import random
 
 DIMENSION = 8
@@ -8,13 +9,22 @@ WIDTH = HEIGHT = 512
 SQUARE = HEIGHT // DIMENSION
 MAX_FPS = 15
 IMAGES = {}
+FONTS = {}
+TEXTS = {}
+COLORS = [p.Color("gray"), p.Color("dark gray")]
 PIECES = ['wP', 'wK', 'wQ', 'wB', 'wR', 'wN', 'bP', 'bK', 'bQ', 'bB', 'bR', 'bN']
+BITBOARD = False  # play on the bitboard backend instead of GameState, both follow the same rules
 
 
 def load_img():
     for piece in PIECES:
         IMAGES[piece] = p.transform.scale(p.image.load("images/"+piece+".png"), (SQUARE, SQUARE))
 
+def newGameState():
+    state = BitboardState() if BITBOARD else GameState()
+    state.moveCache = MoveCache(1000)  # taking a move back finds the earlier position's moves here
+    return state
+
 # PvP Mode
 
 def main():
@@ -23,7 +33,8 @@ def main():
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
     load_img()
-    state = GameState()
+    renderer = BoardRenderer(screen)
+    state = newGameState()
     validMoves = state.getValidMoves()
     moveMade = False
     running = True
@@ -35,6 +46,8 @@ def main():
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type == p.VIDEOEXPOSE:  # the window was uncovered, nothing on screen can be trusted
+                renderer.invalidate()
             elif e.type == p.MOUSEBUTTONDOWN:
                 if not gameOver:
                     position = p.mouse.get_pos()
@@ -64,7 +77,7 @@ def main():
                     animate = False
                     gameOver = False
                 if e.key == p.K_r: # reset game when key "R" is pressed
-                    state = GameState()
+                    state = newGameState()
                     validMoves = state.getValidMoves()
                     sqSelected = ()
                     positions = []
@@ -73,7 +86,7 @@ def main():
                     gameOver = False
         if moveMade:
             if animate:
-                moveAnimation(state.moveLog[-1], screen, state.board, clock)
+                moveAnimation(state.moveLog[-1], renderer, state.board, clock)
             validMoves = state.getValidMoves()
             moveMade = False
             state.checkmate = False
@@ -83,148 +96,214 @@ def main():
                     state.checkmate = True
                 else:
                     state.stalemate = True
-        drawGameState(screen, state, positions, validMoves)
+        text = winner = None
         if state.checkmate:
             gameOver = True
             if state.whiteMoves:
-                drawText(screen, "Black wins by checkmate", (0, 1))
+                text, winner = "Black wins by checkmate", (0, 1)
             else:
-                drawText(screen, "White wins by checkmate", (1, 0))
+                text, winner = "White wins by checkmate", (1, 0)
         elif state.stalemate:
             gameOver = True
-            drawText(screen, "Stalemate", (0, 0))
+            text, winner = "Stalemate", (0, 0)
+        renderer.draw(state.board, positions, validMoves, text, winner)
         clock.tick(MAX_FPS)
-        p.display.flip()
-
-def drawGameState(screen, state, positions, moves):
-    drawBoard(screen)
-    drawPieces(screen, state.board)
-    highlightSquares(screen, state.board, positions, moves)
 
-def drawBoard(screen):
-    global colors
-    colors = [p.Color("gray"), p.Color("dark gray")]
+# Light and dark squares drawn once onto their own surface, which every redraw copies from
+def renderBoard():
+    board = p.Surface((WIDTH, HEIGHT))
     for r in range(DIMENSION):
         for c in range(DIMENSION):
-            color = colors[(r+c) % 2]
-            p.draw.rect(screen, color, p.Rect(c*SQUARE, r*SQUARE, SQUARE, SQUARE))
+            p.draw.rect(board, COLORS[(r + c) % 2], p.Rect(c*SQUARE, r*SQUARE, SQUARE, SQUARE))
+    return board
 
-def drawPieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != '--':
-                screen.blit(IMAGES[piece], p.Rect(c*SQUARE, r*SQUARE, SQUARE, SQUARE))
-
-def highlightSquares(screen, board, positions, moves):
-    viable = []
-    if len(positions) == 1:
-        x = positions[0][0]
-        y = positions[0][1]
-        p.draw.rect(screen, p.Color("red"), p.Rect(y * SQUARE, x * SQUARE, SQUARE, SQUARE), 3)
-        for move in moves:
-            if (move.startR, move.startC) == (x, y):
-                viable.append((move.endR, move.endC))
-        for (r, c) in viable:
-            p.draw.circle(screen, p.Color("red"), (c * SQUARE + SQUARE // 2, r * SQUARE + SQUARE // 2), SQUARE // 6)
-
-def moveAnimation(move, screen, board, clock):
-    global colors
-    coordinates = []
+def getFont(size):
+    if size not in FONTS:
+        FONTS[size] = p.font.SysFont("Halvetica", size, True, False)
+    return FONTS[size]
+
+# Rendered game over message as (surface, position) layers, made once per message
+def renderText(text, winner):
+    if (text, winner) not in TEXTS:
+        col1 = "White" if winner[0] else "Black"
+        col2 = "White" if winner[1] else "Black"
+        if winner[0] == winner[1]:
+            col2 = "black"
+        font = getFont(32)
+        textObject = font.render(text, 0, p.Color(col2))
+        location = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
+        layers = [(textObject, location)]
+        if winner[0] != winner[1]:
+            layers.append((font.render(text, 0, p.Color(col1)), location.move(2, 2)))
+        TEXTS[(text, winner)] = layers
+    return TEXTS[(text, winner)]
+
+# Draws only what changed since the last frame: it remembers the piece and highlight shown on every square and
+# redraws a square (from the cached board surface) when either differs, then updates just those rectangles. An idle
+# position costs no drawing at all.
+class BoardRenderer:
+    def __init__(self, screen):
+        self.screen = screen
+        self.boardSurface = renderBoard()
+        self.shown = [None] * 64  # piece drawn on each square, None when it has to be redrawn
+        self.marks = {}  # square -> "selected" or "target" highlight on screen
+        self.text = None  # (text, winner) on screen and the rectangle it covers
+
+    # Forces a redraw of the given (row, col) squares, or of everything
+    def invalidate(self, squares=None):
+        for r, c in squares if squares is not None else [(r, c) for r in range(DIMENSION) for c in range(DIMENSION)]:
+            self.shown[r*8 + c] = None
+
+    def drawSquare(self, r, c, piece):
+        rect = p.Rect(c*SQUARE, r*SQUARE, SQUARE, SQUARE)
+        self.screen.blit(self.boardSurface, rect, rect)
+        if piece != '--':
+            self.screen.blit(IMAGES[piece], rect)
+        self.shown[r*8 + c] = piece
+        return rect
+
+    def draw(self, board, positions, moves, text=None, winner=None):
+        marks = {}
+        if len(positions) == 1:
+            marks[positions[0]] = "selected"
+            for move in moves:
+                if (move.startR, move.startC) == positions[0]:
+                    marks.setdefault((move.endR, move.endC), "target")
+        message = (text, winner) if text else None
+        if self.text is not None and self.text[0] != message:
+            textRect = self.text[1]
+            self.text = None
+            self.invalidate([(r, c) for r in range(DIMENSION) for c in range(DIMENSION)
+                             if textRect.colliderect(p.Rect(c*SQUARE, r*SQUARE, SQUARE, SQUARE))])
+        rects = []
+        redrawn = set()
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                if self.shown[r*8 + c] != board[r][c] or self.marks.get((r, c)) != marks.get((r, c)):
+                    rects.append(self.drawSquare(r, c, board[r][c]))
+                    redrawn.add((r, c))
+        for (r, c), mark in marks.items():
+            if (r, c) not in redrawn:
+                continue
+            if mark == "selected":
+                p.draw.rect(self.screen, p.Color("red"), p.Rect(c * SQUARE, r * SQUARE, SQUARE, SQUARE), 3)
+            else:
+                p.draw.circle(self.screen, p.Color("red"), (c * SQUARE + SQUARE // 2, r * SQUARE + SQUARE // 2), SQUARE // 6)
+        self.marks = marks
+        if message is not None and (self.text is None or any(self.text[1].colliderect(rect) for rect in rects)):
+            layers = renderText(text, winner)
+            for surface, location in layers:
+                self.screen.blit(surface, location)
+            surface, location = layers[0]
+            textRect = p.Rect(location.topleft, (surface.get_width() + 2, surface.get_height() + 2))
+            self.text = (message, textRect)
+            rects.append(textRect)
+        if rects:
+            p.display.update(rects)
+
+# Slides the moved piece from its start square to its end square, restoring only the squares it leaves behind
+def moveAnimation(move, renderer, board, clock):
     dR = move.endR - move.startR
     dC = move.endC - move.startC
     FPS = 10
     frameCount = (abs(dR) + abs(dC))*FPS
+    # The position after the move, with the captured piece still on the end square under the moving one
+    shown = [row[:] for row in board]
+    shown[move.endR][move.endC] = move.pieceCaptured if not move.isEnpassantMove else '--'
+    renderer.draw(shown, [], [])
+    previous = None
     for frame in range(frameCount + 1):
         x, y = (move.startR + dR*frame/frameCount, move.startC + dC*frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        color = colors[(move.endR + move.endC) % 2]
-        endSquare = p.Rect(move.endC * SQUARE, move.endR*SQUARE, SQUARE, SQUARE)
-        p.draw.rect(screen, color, endSquare)
-        if move.pieceCaptured != '--':
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(y*SQUARE, x*SQUARE, SQUARE, SQUARE))
-        p.display.flip()
+        pieceRect = p.Rect(round(y*SQUARE), round(x*SQUARE), SQUARE, SQUARE)
+        rects = [pieceRect]
+        if previous is not None:
+            for r, c in coveredSquares(previous):
+                rects.append(renderer.drawSquare(r, c, shown[r][c]))
+        renderer.screen.blit(IMAGES[move.pieceMoved], pieceRect)
+        p.display.update(rects)
+        previous = pieceRect
         clock.tick(60)
+    renderer.invalidate(coveredSquares(previous))
 
-def drawText(screen, text, winner):
-    col1 = "White" if winner[0] else "Black"
-    col2 = "White" if winner[1] else "Black"
-    if winner[0] == winner[1]:
-        col2 = "black gray"
-    font = p.font.SysFont("Halvetica", 32, True, False)
-    textObject = font.render(text, 0, p.Color(col2))
-    location = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
-    screen.blit(textObject, location)
-    if winner[0] != winner[1]:
-        textObject = font.render(text, 0, p.Color(col1))
-        screen.blit(textObject, location.move(2, 2))
-
-def playingvsBot():
+# (row, col) of the squares a rectangle overlaps
+def coveredSquares(rect):
+    return [(r, c) for r in range(max(rect.top // SQUARE, 0), min((rect.bottom - 1) // SQUARE, DIMENSION - 1) + 1)
+            for c in range(max(rect.left // SQUARE, 0), min((rect.right - 1) // SQUARE, DIMENSION - 1) + 1)]
+
+def playingvsBot(ponder=True):
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
     load_img()
-    state = GameState()
+    renderer = BoardRenderer(screen)
+    state = newGameState()
     validMoves = state.getValidMoves()
     moveMade = False
     running = True
     sqSelected = ()
     positions = []
     animate = False
-    bot = RandomBot  # bot takes the type of AI you'll play against, for now only RandomBot is available
+    bot = AlphaBetaBot(timeLimit=1.0)  # bot takes the type of AI you'll play against: RandomBot or AlphaBetaBot
+    worker = SearchThread(bot, ponder)  # the bot thinks on its own thread so the window keeps drawing
     while running:
-        if state.whiteMoves:
-            for e in p.event.get():
-                if e.type == p.QUIT:
-                    running = False
-                elif e.type == p.MOUSEBUTTONDOWN:
-                        position = p.mouse.get_pos()
-                        col = position[0]//SQUARE
-                        row = position[1]//SQUARE
-                        if sqSelected == (row, col):
-                            sqSelected = ()
-                            positions = []
-                        else:
-                            sqSelected = (row, col)
-                            positions.append(sqSelected)
-                        if len(positions) == 2:
-                            move = Move(positions[0], positions[1], state.board)
-                            for i in range(len(validMoves)):
-                                if move == validMoves[i]:
-                                    state.makeMove(move)
-                                    moveMade = True
-                                    sqSelected = ()
-                                    positions = []
-                                    animate = True
-                            if not moveMade:
-                                positions = []
-                elif e.type == p.KEYDOWN:
-                    if e.key == p.K_u:  # undo move when key "U" is pressed
-                        state.undoMove()
-                        moveMade = True
-                        animate = False
-                    if e.key == p.K_r:  # reset game when key "R" is pressed
-                        state = GameState()
-                        validMoves = state.getValidMoves()
+        for e in p.event.get():
+            if e.type == p.QUIT:
+                running = False
+            elif e.type == p.VIDEOEXPOSE:  # the window was uncovered, nothing on screen can be trusted
+                renderer.invalidate()
+            elif e.type == p.MOUSEBUTTONDOWN and state.whiteMoves:
+                    position = p.mouse.get_pos()
+                    col = position[0]//SQUARE
+                    row = position[1]//SQUARE
+                    if sqSelected == (row, col):
                         sqSelected = ()
                         positions = []
-                        animate = False
-                        moveMade = False
-        else:
-            index = bot(validMoves)
-            state.makeMove(validMoves[index])
-            moveMade = True
+                    else:
+                        sqSelected = (row, col)
+                        positions.append(sqSelected)
+                    if len(positions) == 2:
+                        move = Move(positions[0], positions[1], state.board)
+                        for i in range(len(validMoves)):
+                            if move == validMoves[i]:
+                                state.makeMove(validMoves[i])
+                                moveMade = True
+                                sqSelected = ()
+                                positions = []
+                                animate = True
+                        if not moveMade:
+                            positions = []
+            elif e.type == p.KEYDOWN:
+                if e.key == p.K_u:  # undo move when key "U" is pressed
+                    worker.cancel()
+                    state.undoMove()
+                    moveMade = True
+                    animate = False
+                if e.key == p.K_r:  # reset game when key "R" is pressed
+                    worker.cancel()
+                    state = newGameState()
+                    validMoves = state.getValidMoves()
+                    sqSelected = ()
+                    positions = []
+                    animate = False
+                    moveMade = False
+        if not state.whiteMoves and not moveMade and len(validMoves) > 0:
+            if not worker.thinking():
+                worker.think(state)
+            index = worker.poll(validMoves)
+            if index is not None:
+                state.makeMove(validMoves[index])
+                moveMade = True
+                worker.startPondering(state)
         if moveMade:
             if animate:
-                moveAnimation(state.moveLog[-1], screen, state.board, clock)
+                moveAnimation(state.moveLog[-1], renderer, state.board, clock)
             validMoves = state.getValidMoves()
             moveMade = False
-        drawGameState(screen, state, positions, validMoves)
+        renderer.draw(state.board, positions, validMoves)
         clock.tick(MAX_FPS)
-        p.display.flip()
+    worker.cancel()
 
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import numpy as np
+from Network import encodeArray
+
+# Reads the shards written by SelfPlay.py. Every shard is memory mapped as an array of records, so a dataset of any
+# size opens instantly and only the records a batch touches are read from disk. Needs numpy.
+#   python Dataset.py data --batch 4
+
+RECORD_DTYPE = np.dtype([('snapshot', 'u1', 69), ('result', 'i1'), ('score', '<i2'), ('move', '<u2')])
+
+
+class Dataset:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json")) as file:
+            index = json.load(file)
+        if index["recordSize"] != RECORD_DTYPE.itemsize:
+            raise ValueError("%s has %d byte records, expected %d" % (directory, index["recordSize"],
+                                                                     RECORD_DTYPE.itemsize))
+        self.shards = [np.memmap(os.path.join(directory, shard["file"]), RECORD_DTYPE, 'r', shape=(shard["records"],))
+                       for shard in index["shards"] if shard["records"]]
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    # Structured array of the records at the given global indexes, in that order
+    def records(self, indexes):
+        indexes = np.asarray(indexes, np.int64)
+        if len(indexes) and (indexes.min() < 0 or indexes.max() >= len(self)):
+            raise IndexError("record index out of range")
+        found = np.empty(len(indexes), RECORD_DTYPE)
+        shardOf = np.searchsorted(self.offsets, indexes, side='right') - 1
+        for shard in np.unique(shardOf):
+            chosen = shardOf == shard
+            found[chosen] = self.shards[shard][indexes[chosen] - self.offsets[shard]]
+        return found
+
+    # Training batch: (N, 12, 8, 8) planes, side to move, result, search score and move code
+    def batch(self, indexes, dtype=np.float32):
+        records = self.records(indexes)
+        planes, whiteMoves = encodeArray(records['snapshot'], dtype)
+        return {"planes": planes, "whiteMoves": whiteMoves, "result": records['result'],
+                "score": records['score'], "move": records['move']}
+
+    def sample(self, size, rng=None, dtype=np.float32):
+        rng = rng if rng is not None else np.random.default_rng()
+        return self.batch(rng.integers(0, len(self), size), dtype)
+
+    # Shuffled batches covering every record once
+    def epoch(self, size, rng=None, dtype=np.float32):
+        rng = rng if rng is not None else np.random.default_rng()
+        order = rng.permutation(len(self))
+        for start in range(0, len(order), size):
+            yield self.batch(order[start:start + size], dtype)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a self-play dataset")
+    parser.add_argument("directory")
+    parser.add_argument("--batch", type=int, default=0, help="print this many random positions")
+    args = parser.parse_args()
+
+    from ChessEngine import GameState, decodeMove
+    dataset = Dataset(args.directory)
+    print("%d records in %d shards" % (len(dataset), len(dataset.shards)))
+    if len(dataset) and args.batch:
+        records = dataset.records(np.random.default_rng().integers(0, len(dataset), args.batch))
+        for record in records:
+            state = GameState.fromBytes(record['snapshot'].tobytes())
+            print("%s  result %+d  score %+6d  move %s" % (state.getFEN(), record['result'], record['score'],
+                                                           decodeMove(int(record['move']), state.board).getNotation()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# Material and piece-square tables with separate middlegame and endgame values. The score is tapered between the two
+# by the game phase, worked out from the pieces left: 24 with all minor and major pieces on the board, 0 with none.
+# Both position backends keep (middlegame, endgame, phase) up to date in makeMove / undoMove, so evaluating a
+# position only blends two numbers.
+
+MATERIAL_MG = {'P': 82, 'N': 337, 'B': 365, 'R': 477, 'Q': 1025, 'K': 0}
+MATERIAL_EG = {'P': 94, 'N': 281, 'B': 297, 'R': 512, 'Q': 936, 'K': 0}
+PHASE_WEIGHTS = {'P': 0, 'N': 1, 'B': 1, 'R': 2, 'Q': 4, 'K': 0}
+FULL_PHASE = 24
+
+# Tables from white's point of view, first row is the 8th rank like GameState.board
+PAWN_MG = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0]
+PAWN_EG = [bonus for bonus in (0, 60, 35, 20, 10, 5, 0, 0) for _ in range(8)]
+KNIGHT = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50]
+BISHOP = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20]
+ROOK = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0]
+QUEEN = [
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20]
+KING_MG = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20]
+KING_EG = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50]
+
+TABLES_MG = {'P': PAWN_MG, 'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN, 'K': KING_MG}
+TABLES_EG = {'P': PAWN_EG, 'N': KNIGHT, 'B': BISHOP, 'R': ROOK, 'Q': QUEEN, 'K': KING_EG}
+
+
+# Material plus table value of each piece on each square, positive for white and negative for black (whose tables
+# are flipped vertically). '--' is all zeros so captures of nothing need no special case.
+def pieceSquareTable(material, tables):
+    table = {'--': [0] * 64}
+    for piece, values in tables.items():
+        table['w' + piece] = [material[piece] + values[sq] for sq in range(64)]
+        table['b' + piece] = [-material[piece] - values[sq ^ 56] for sq in range(64)]
+    return table
+
+
+PSQT_MG = pieceSquareTable(MATERIAL_MG, TABLES_MG)
+PSQT_EG = pieceSquareTable(MATERIAL_EG, TABLES_EG)
+PHASE = {'--': 0}
+PHASE.update({color + piece: weight for color in 'wb' for piece, weight in PHASE_WEIGHTS.items()})
+
+
+# (middlegame, endgame, phase) of a board from scratch, squares numbered row * 8 + col
+def evalTerms(board):
+    mg = eg = phase = 0
+    for sq, piece in enumerate(board):
+        mg += PSQT_MG[piece][sq]
+        eg += PSQT_EG[piece][sq]
+        phase += PHASE[piece]
+    return mg, eg, phase
+
+
+# The blended score in centipawns from the side to move's point of view
+def taperedScore(terms, whiteMoves):
+    mg, eg, phase = terms
+    phase = min(phase, FULL_PHASE)  # promotions can push it past the starting value
+    score = (mg * phase + eg * (FULL_PHASE - phase)) // FULL_PHASE
+    return score if whiteMoves else -score
@@ -0,0 +1,211 @@
+import argparse
+import struct
+import time
+import numpy as np
+from ChessEngine import GameState, SNAPSHOT_PIECES
+from Bitboard import BitboardState
+
+# Efficiently updatable neural network evaluation. The first layer has one input per (piece, square) and is kept as an
+# int16 accumulator for each side's point of view; a move only adds and subtracts the weight rows of the few pieces it
+# touches, so evaluating costs an update plus one small dot product instead of a full forward pass. Needs numpy.
+#
+# Network file: header (magic, hidden size, clip, scale), then little endian arrays: feature weights int16
+# [768][hidden], feature biases int16 [hidden], output weights int16 [2 * hidden] (side to move half first) and the
+# output bias int32. score = (clip(us) . output[:hidden] + clip(them) . output[hidden:] + bias) // scale, where
+# clip(x) = min(max(x, 0), clip). Features are seen from each side: for black the colors are swapped and the board is
+# flipped, so one set of weights serves both.
+#   python NNUE.py psqt --out psqt.nnue
+#   python NNUE.py bench --network psqt.nnue
+
+MAGIC = b'CNN1'
+HEADER = struct.Struct('<4sHHI')
+FEATURES = 768
+PLANE_INDEX = {piece: i - 1 for i, piece in enumerate(SNAPSHOT_PIECES) if i}  # wP=0 ... bK=11
+
+
+def feature(piece, sq):
+    return PLANE_INDEX[piece] * 64 + sq
+
+
+# The same piece and square as seen by black
+def mirroredFeature(piece, sq):
+    return PLANE_INDEX[('b' if piece[0] == 'w' else 'w') + piece[1]] * 64 + (sq ^ 56)
+
+
+MIRROR = np.array([mirroredFeature(piece, sq) for piece in PLANE_INDEX for sq in range(64)])
+
+
+class NNUENetwork:
+    def __init__(self, featureWeights, featureBiases, outputWeights, outputBias, clip=255, scale=64):
+        self.featureWeights = np.asarray(featureWeights, np.int16).reshape(FEATURES, -1)
+        self.featureBiases = np.asarray(featureBiases, np.int16)
+        self.outputWeights = np.asarray(outputWeights, np.int16)
+        self.outputBias = int(outputBias)
+        self.hidden = self.featureWeights.shape[1]
+        self.clip = clip
+        self.scale = scale
+        # Row f holds the white and the black accumulator change for feature f, so an update is one row operation
+        self.columns = np.concatenate([self.featureWeights, self.featureWeights[MIRROR]], axis=1)
+        self.biases = np.concatenate([self.featureBiases, self.featureBiases])
+        self.usWeights = self.outputWeights[:self.hidden].astype(np.int32)
+        self.themWeights = self.outputWeights[self.hidden:].astype(np.int32)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            data = file.read()
+        magic, hidden, clip, scale = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("%s is not a network file" % path)
+        offset = HEADER.size
+        arrays = []
+        for count, kind in ((FEATURES * hidden, '<i2'), (hidden, '<i2'), (2 * hidden, '<i2'), (1, '<i4')):
+            arrays.append(np.frombuffer(data, kind, count, offset))
+            offset += count * arrays[-1].itemsize
+        if offset != len(data):
+            raise ValueError("%s has the wrong size for %d hidden units" % (path, hidden))
+        return cls(arrays[0], arrays[1], arrays[2], arrays[3][0], clip, scale)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, self.hidden, self.clip, self.scale))
+            file.write(self.featureWeights.astype('<i2').tobytes())
+            file.write(self.featureBiases.astype('<i2').tobytes())
+            file.write(self.outputWeights.astype('<i2').tobytes())
+            file.write(np.array([self.outputBias], '<i4').tobytes())
+
+    @classmethod
+    def random(cls, hidden=128, seed=0):
+        rng = np.random.default_rng(seed)
+        return cls(rng.integers(-32, 33, (FEATURES, hidden)), rng.integers(0, 64, hidden),
+                   rng.integers(-64, 65, 2 * hidden), 0)
+
+    # Accumulator of a position from scratch: white's half then black's
+    def refresh(self, state):
+        squares = np.frombuffer(state.toBytes(), np.uint8, 64)
+        occupied = np.flatnonzero(squares)
+        features = (squares[occupied].astype(np.intp) - 1) * 64 + occupied
+        return (self.biases + self.columns[features].sum(axis=0, dtype=np.int16)).astype(np.int16)
+
+    # Score from the side to move's point of view
+    def output(self, accumulator, whiteMoves):
+        white = np.clip(accumulator[:self.hidden], 0, self.clip)
+        black = np.clip(accumulator[self.hidden:], 0, self.clip)
+        us, them = (white, black) if whiteMoves else (black, white)
+        return (int(us @ self.usWeights) + int(them @ self.themWeights) + self.outputBias) // self.scale
+
+
+# A network whose first hidden unit carries the middlegame material and piece-square score of Evaluation.py, offset so
+# it stays inside the clip range. It plays like the piece-square evaluation and is a check of the accumulator.
+def psqtNetwork(hidden=32):
+    from Evaluation import PSQT_MG
+    offset = 16384
+    featureWeights = np.zeros((FEATURES, hidden), np.int16)
+    for piece in PLANE_INDEX:
+        for sq in range(64):
+            featureWeights[feature(piece, sq), 0] = PSQT_MG[piece][sq]
+    featureBiases = np.zeros(hidden, np.int16)
+    featureBiases[0] = offset
+    outputWeights = np.zeros(2 * hidden, np.int16)
+    outputWeights[0] = 1
+    return NNUENetwork(featureWeights, featureBiases, outputWeights, -offset, clip=32767, scale=1)
+
+
+# (removed, added) features of a move, from the Move alone so it works for either backend
+def moveFeatures(move):
+    start = move.startR * 8 + move.startC
+    end = move.endR * 8 + move.endC
+    moved = move.pieceMoved
+    removed = [feature(moved, start)]
+    added = [feature(moved[0] + 'Q' if move.isPawnPromotion else moved, end)]
+    if move.isEnpassantMove:
+        removed.append(feature(move.pieceCaptured, move.startR * 8 + move.endC))
+    elif move.pieceCaptured != '--':
+        removed.append(feature(move.pieceCaptured, end))
+    elif move.isCastleMove:
+        rookFrom, rookTo = (end + 1, end - 1) if end > start else (end - 2, end + 1)
+        removed.append(feature(moved[0] + 'R', rookFrom))
+        added.append(feature(moved[0] + 'R', rookTo))
+    return removed, added
+
+
+# Stack of accumulators, one per ply from the position it was reset on. The search doesn't call it on every
+# makeMove / undoMove: before an evaluation it pops the plies whose moves were undone and pushes the ones made since,
+# so positions that are never evaluated are never updated either. Moves are compared by identity, which is safe because
+# every position of the stack descends from the same root.
+class Accumulator:
+    def __init__(self, network):
+        self.network = network
+        self.base = 0
+        self.moves = []
+        self.stack = []
+
+    def reset(self, state):
+        self.base = len(state.moveLog)
+        self.moves = []
+        self.stack = [self.network.refresh(state)]
+
+    def push(self, move):
+        columns = self.network.columns
+        removed, added = moveFeatures(move)
+        accumulator = self.stack[-1] + columns[added[0]] - columns[removed[0]]
+        for f in added[1:]:
+            accumulator += columns[f]
+        for f in removed[1:]:
+            accumulator -= columns[f]
+        self.moves.append(move)
+        self.stack.append(accumulator)
+
+    def pop(self):
+        self.moves.pop()
+        self.stack.pop()
+
+    def sync(self, state):
+        log = state.moveLog
+        if len(log) < self.base or not self.stack:
+            self.reset(state)
+            return
+        common = 0
+        limit = min(len(self.moves), len(log) - self.base)
+        while common < limit and self.moves[common] is log[self.base + common]:
+            common += 1
+        while len(self.moves) > common:
+            self.pop()
+        for move in log[self.base + common:]:
+            self.push(move)
+
+    def evaluate(self, state):
+        self.sync(state)
+        return self.network.output(self.stack[-1], state.whiteMoves)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write and benchmark NNUE networks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    psqt = commands.add_parser("psqt", help="write the piece-square network")
+    psqt.add_argument("--out", required=True)
+    psqt.add_argument("--hidden", type=int, default=32)
+    bench = commands.add_parser("bench", help="search with the network and report the speed")
+    bench.add_argument("--network", help="network file, the piece-square network by default")
+    bench.add_argument("--fen")
+    bench.add_argument("--depth", type=int, default=4)
+    bench.add_argument("--bitboard", action="store_true", help="use the bitboard backend")
+    args = parser.parse_args()
+
+    if args.command == "psqt":
+        psqtNetwork(args.hidden).save(args.out)
+        print("wrote %s" % args.out)
+        return
+    from AI import AlphaBetaBot, NNUEBot
+    state = (BitboardState if args.bitboard else GameState)(args.fen)
+    for bot in (AlphaBetaBot(maxDepth=args.depth, timeLimit=None),
+                NNUEBot(network=args.network, maxDepth=args.depth, timeLimit=None)):
+        start = time.perf_counter()
+        move, score = bot.search(state)
+        elapsed = time.perf_counter() - start
+        print("%-13s depth %d  score %6d  move %s  %7d nodes  %.2fs  %6.0f nps" %
+              (type(bot).__name__, args.depth, score, move.getNotation(), bot.nodes, elapsed, bot.nodes / elapsed))
+
+
+if __name__ == '__main__':
+    main()
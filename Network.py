@@ -0,0 +1,150 @@
+import argparse
+import random
+import time
+import numpy as np
+from ChessEngine import GameState, SNAPSHOT, SNAPSHOT_PIECES
+from Bitboard import BitboardState
+from Evaluation import PSQT_MG
+
+# Batched position encoding and a small NumPy MLP evaluator, for scoring or training on many positions at once
+# instead of paying Python overhead per position. Positions go through their 69 byte snapshots (toBytes), so the
+# encoding is a couple of array operations over the whole batch. Needs numpy, which the rest of the engine doesn't.
+#   python Network.py bench --positions 20000
+
+PLANES = SNAPSHOT_PIECES[1:]  # plane i holds the squares of PLANES[i]: wP wN wB wR wQ wK bP bN bB bR bQ bK
+PLANE_CODES = np.arange(1, len(SNAPSHOT_PIECES), dtype=np.uint8).reshape(1, len(PLANES), 1)
+INPUTS = len(PLANES) * 64
+
+
+# (N, 69) uint8 view of a list of snapshots
+def snapshotArray(snapshots):
+    return np.frombuffer(b''.join(snapshots), dtype=np.uint8).reshape(-1, SNAPSHOT.size)
+
+
+# (N, 12, 8, 8) planes with a 1 wherever a piece stands (row 0 is the 8th rank, like GameState.board) and the (N,)
+# side to move as booleans, True for white
+def encodeSnapshots(snapshots, dtype=np.uint8):
+    return encodeArray(snapshotArray(snapshots), dtype)
+
+
+# Same for snapshots already in an (N, 69) uint8 array
+def encodeArray(data, dtype=np.uint8):
+    planes = (data[:, None, :64] == PLANE_CODES).reshape(-1, len(PLANES), 8, 8).astype(dtype)
+    return planes, (data[:, 64] & 1) == 0
+
+
+# Same for GameState or BitboardState objects
+def encodePositions(states, dtype=np.uint8):
+    return encodeSnapshots([state.toBytes() for state in states], dtype)
+
+
+# Fully connected network with ReLU between layers and a single output, the score in centipawns from white's point of
+# view. Weights are stored as (inputs, outputs) float32 matrices.
+class MLP:
+    def __init__(self, layers):
+        self.layers = [(np.asarray(weights, np.float32), np.asarray(biases, np.float32)) for weights, biases in layers]
+
+    @classmethod
+    def random(cls, sizes=(INPUTS, 256, 32, 1), seed=0):
+        rng = np.random.default_rng(seed)
+        return cls([(rng.standard_normal((inputs, outputs)) * np.sqrt(2.0 / inputs), np.zeros(outputs))
+                    for inputs, outputs in zip(sizes, sizes[1:])])
+
+    # Saved with save(): arrays w0, b0, w1, b1, ... in an .npz file
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls([(data['w%d' % i], data['b%d' % i]) for i in range(len(data.files) // 2)])
+
+    def save(self, path):
+        arrays = {}
+        for i, (weights, biases) in enumerate(self.layers):
+            arrays['w%d' % i] = weights
+            arrays['b%d' % i] = biases
+        np.savez(path, **arrays)
+
+    # Scores from white's point of view for (N, 12, 8, 8) planes
+    def forward(self, planes):
+        x = planes.reshape(len(planes), -1).astype(np.float32, copy=False)
+        for i, (weights, biases) in enumerate(self.layers):
+            x = x @ weights + biases
+            if i < len(self.layers) - 1:
+                np.maximum(x, 0, out=x)
+        return x[:, 0]
+
+    # Scores from the side to move's point of view, like AI.evaluate
+    def evaluate(self, planes, whiteMoves):
+        scores = self.forward(planes)
+        return np.where(whiteMoves, scores, -scores)
+
+    # Encodes and scores a list of states, chunk positions at a time to bound memory
+    def evaluatePositions(self, states, chunk=4096):
+        scores = [self.evaluate(*encodePositions(states[i:i + chunk])) for i in range(0, len(states), chunk)]
+        return np.concatenate(scores) if scores else np.zeros(0, np.float32)
+
+
+# A single layer network that reproduces the middlegame material and piece-square score of Evaluation.py, a starting
+# point for training and a check of the encoding
+def psqtNetwork():
+    weights = np.array([PSQT_MG[piece][sq] for piece in PLANES for sq in range(64)], np.float32).reshape(INPUTS, 1)
+    return MLP([(weights, np.zeros(1))])
+
+
+# Snapshots of the positions met in random games, for benchmarks and tests
+def randomSnapshots(count, seed=0, stateClass=BitboardState, maxPlies=120):
+    rng = random.Random(seed)
+    snapshots = []
+    while len(snapshots) < count:
+        state = stateClass()
+        for _ in range(maxPlies):
+            moves = state.getValidMoves()
+            if len(moves) == 0 or len(snapshots) >= count:
+                break
+            state.makeMove(rng.choice(moves))
+            snapshots.append(state.toBytes())
+    return snapshots
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched position encoding and network evaluation")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bench = commands.add_parser("bench", help="compare network evaluation one position per call and batched")
+    bench.add_argument("--positions", type=int, default=20000)
+    bench.add_argument("--network", help="weights saved with MLP.save, a random 768-256-32-1 network by default")
+    bench.add_argument("--bitboard", action="store_true", help="use the bitboard backend")
+    args = parser.parse_args()
+
+    stateClass = BitboardState if args.bitboard else GameState
+    states = [stateClass.fromBytes(data) for data in randomSnapshots(args.positions, stateClass=stateClass)]
+    network = MLP.load(args.network) if args.network else MLP.random()
+
+    start = time.perf_counter()
+    planes, whiteMoves = encodePositions(states)
+    encoded = time.perf_counter() - start
+    # The same network on the same encoded rows, one row per call and then all of them in one call
+    start = time.perf_counter()
+    for i in range(len(states)):
+        network.evaluate(planes[i:i + 1], whiteMoves[i:i + 1])
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    network.evaluate(planes, whiteMoves)
+    batched = time.perf_counter() - start
+    start = time.perf_counter()
+    for state in states:
+        state.evaluation()
+    incremental = time.perf_counter() - start
+
+    psqt = psqtNetwork().evaluatePositions(states)
+    mismatches = sum(1 for state, score in zip(states, psqt)
+                     if score != (state.evalTerms[0] if state.whiteMoves else -state.evalTerms[0]))
+    print("%d positions" % len(states))
+    print("encoding                  %8.0f positions/s" % (len(states) / encoded))
+    print("network, one per call     %8.0f positions/s" % (len(states) / single))
+    print("network, one batch        %8.0f positions/s  %.0fx" % (len(states) / batched, single / batched))
+    print("incremental piece-square  %8.0f positions/s  (state.evaluation(), no network)" %
+          (len(states) / incremental))
+    print("psqt network mismatches   %8d" % mismatches)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import re
+import time
+from ChessEngine import GameState, Move, moveClocks
+from Bitboard import BitboardState
+
+# Streaming PGN reading and writing. readGames yields one game at a time and only ever holds the current game, so it
+# works through archives of any size. Moves stay in SAN until a game is replayed, which resolves each one against
+# getValidMoves. The engine always promotes to a queen, so games with an underpromotion can't be replayed.
+#   python PGN.py replay games.pgn --bitboard
+
+TAG = re.compile(r'\[(\w+)\s+"(.*)"\s*\]')
+TOKEN = re.compile(r'[{}();]|[^\s{}();]+')
+MOVE_NUMBER = re.compile(r'^\d+\.+')
+SAN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(=?[NBRQ])?$')
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+
+# Games as dicts with "tags", "moves" (SAN strings) and "result", from a path or an open text file
+def readGames(source):
+    games = open(source, encoding='utf-8', errors='replace') if isinstance(source, str) else source
+    tags = {}
+    moves = []
+    comment = False  # inside {...}, which can span lines
+    variation = 0  # depth of (...) variations, which are skipped
+    try:
+        for line in games:
+            line = line.strip()
+            if not comment and variation == 0 and line.startswith('['):
+                if moves:
+                    yield {"tags": tags, "moves": moves, "result": tags.get("Result", "*")}
+                    tags, moves = {}, []
+                match = TAG.match(line)
+                if match:
+                    tags[match.group(1)] = match.group(2).replace('\\"', '"')
+                continue
+            if line.startswith('%'):
+                continue
+            for token in TOKEN.findall(line):
+                if comment:
+                    comment = token != '}'
+                elif token == '{':
+                    comment = True
+                elif token == ';':
+                    break
+                elif token == '(':
+                    variation += 1
+                elif token == ')':
+                    variation -= 1
+                elif variation == 0 and token[0] != '$':
+                    if token in RESULTS:
+                        yield {"tags": tags, "moves": moves, "result": token}
+                        tags, moves = {}, []
+                        continue
+                    token = MOVE_NUMBER.sub('', token)
+                    if token:
+                        moves.append(token)
+        if moves or tags:
+            yield {"tags": tags, "moves": moves, "result": tags.get("Result", "*")}
+    finally:
+        if isinstance(source, str):
+            games.close()
+
+
+# The legal move a SAN string stands for, raises ValueError for illegal, ambiguous or underpromotion moves
+def sanToMove(state, san, moves=None):
+    moves = state.getValidMoves() if moves is None else moves
+    text = san.rstrip('+#!?')
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        col = 6 if len(text) == 3 else 2
+        for move in moves:
+            if move.isCastleMove and move.endC == col:
+                return move
+        raise ValueError("illegal castling %s" % san)
+    match = SAN.match(text)
+    if match is None:
+        raise ValueError("can't read move %s" % san)
+    piece, fromFile, fromRank, target, promotion = match.groups()
+    if promotion and promotion[-1] != 'Q':
+        raise ValueError("underpromotion %s is not supported" % san)
+    endR, endC = Move.ranksToRows[target[1]], Move.filesToCols[target[0]]
+    candidates = [move for move in moves if move.pieceMoved[1] == (piece or 'P') and move.endR == endR and
+                  move.endC == endC and not move.isCastleMove and
+                  (fromFile is None or move.startC == Move.filesToCols[fromFile]) and
+                  (fromRank is None or move.startR == Move.ranksToRows[fromRank])]
+    if len(candidates) != 1:
+        raise ValueError("%s move %s" % ("illegal" if not candidates else "ambiguous", san))
+    return candidates[0]
+
+
+# SAN for a legal move in this position, with + or # worked out by playing it
+def moveToSan(state, move, moves=None):
+    san = sanText(move, state.getValidMoves() if moves is None else moves)
+    state.makeMove(move)
+    if state.Check():
+        san += '#' if len(state.getValidMoves()) == 0 else '+'
+    state.undoMove()
+    return san
+
+
+# SAN for a legal move without the check suffix, disambiguated against moves, the position's legal moves
+def sanText(move, moves):
+    target = move.colsToFiles[move.endC] + move.rowsToRanks[move.endR]
+    piece = move.pieceMoved[1]
+    if move.isCastleMove:
+        san = 'O-O' if move.endC == 6 else 'O-O-O'
+    elif piece == 'P':
+        san = (move.colsToFiles[move.startC] + 'x' if move.pieceCaptured != '--' else '') + target
+        if move.isPawnPromotion:
+            san += '=Q'
+    else:
+        others = [m for m in moves if m.pieceMoved == move.pieceMoved and m.endR == move.endR and
+                  m.endC == move.endC and m is not move and (m.startR, m.startC) != (move.startR, move.startC)]
+        origin = ''
+        if others:
+            if all(m.startC != move.startC for m in others):
+                origin = move.colsToFiles[move.startC]
+            elif all(m.startR != move.startR for m in others):
+                origin = move.rowsToRanks[move.startR]
+            else:
+                origin = move.colsToFiles[move.startC] + move.rowsToRanks[move.startR]
+        san = piece + origin + ('x' if move.pieceCaptured != '--' else '') + target
+    return san
+
+
+# The state a game starts from, honoring a FEN tag
+def startingState(game, stateClass=GameState):
+    return stateClass(game["tags"].get("FEN"))
+
+
+# Plays a game's moves on a fresh state, yielding each Move before it is made
+def replayGame(game, stateClass=GameState):
+    state = startingState(game, stateClass)
+    for san in game["moves"]:
+        move = sanToMove(state, san)
+        yield move
+        state.makeMove(move)
+
+
+# PGN text for a game given as Move objects played from fen (or the start position)
+def formatGame(moves, tags=None, result='*', fen=None, stateClass=GameState):
+    tags = dict(tags or {})
+    tags.setdefault("Result", result)
+    if fen is not None:
+        tags.setdefault("SetUp", "1")
+        tags.setdefault("FEN", fen)
+    state = stateClass(fen)
+    lines = ['[%s "%s"]' % (name, str(value).replace('"', '\\"')) for name, value in tags.items()]
+    lines.append('')
+    words = []
+    number = moveClocks(state)[1]
+    # Each position's legal moves are generated once, for the SAN of the move played from it and for whether the
+    # move before it gave check or mate
+    legal = state.getValidMoves()
+    for move in moves:
+        if state.whiteMoves:
+            words.append('%d.' % number)
+        elif not words:
+            words.append('%d...' % number)
+        san = sanText(move, legal)
+        state.makeMove(move)
+        legal = state.getValidMoves()
+        if state.inCheck:
+            san += '#' if len(legal) == 0 else '+'
+        words.append(san)
+        if state.whiteMoves:
+            number += 1
+    words.append(result)
+    line = ''
+    for word in words:
+        if line and len(line) + 1 + len(word) > 79:
+            lines.append(line)
+            line = word
+        else:
+            line = line + ' ' + word if line else word
+    lines.append(line)
+    return '\n'.join(lines) + '\n\n'
+
+
+# Replays every game of a PGN file through makeMove and returns counts and speed. Games that can't be replayed (bad
+# SAN, underpromotion) are counted as errors and skipped.
+def replayGames(source, stateClass=GameState, limit=None, verbose=False):
+    games = plies = errors = 0
+    start = time.perf_counter()
+    for game in readGames(source):
+        if limit is not None and games + errors >= limit:
+            break
+        try:
+            for move in replayGame(game, stateClass):
+                plies += 1
+        except ValueError as error:
+            errors += 1
+            if verbose:
+                print("game %d: %s" % (games + errors, error))
+            continue
+        games += 1
+    elapsed = time.perf_counter() - start
+    return {"games": games, "errors": errors, "plies": plies, "time": elapsed,
+            "gamesPerSecond": games / elapsed if elapsed > 0 else 0.0,
+            "pliesPerSecond": plies / elapsed if elapsed > 0 else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read, replay and convert PGN files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replay = commands.add_parser("replay", help="replay every game and report the speed")
+    replay.add_argument("pgn")
+    replay.add_argument("--limit", type=int, help="stop after this many games")
+    replay.add_argument("--bitboard", action="store_true", help="use the bitboard backend")
+    replay.add_argument("--verbose", action="store_true", help="print the reason for every skipped game")
+    convert = commands.add_parser("convert", help="write the games as coordinate moves, one game per line")
+    convert.add_argument("pgn")
+    convert.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    if args.command == "replay":
+        stats = replayGames(args.pgn, BitboardState if args.bitboard else GameState, args.limit, args.verbose)
+        print("%d games (%d skipped), %d plies in %.1fs: %.1f games/s, %.0f plies/s" %
+              (stats["games"], stats["errors"], stats["plies"], stats["time"], stats["gamesPerSecond"],
+               stats["pliesPerSecond"]))
+    else:
+        with open(args.out, 'w') as out:
+            for game in readGames(args.pgn):
+                if "FEN" in game["tags"]:
+                    continue  # the one game per line format always starts from the initial position
+                try:
+                    moves = [move.getNotation() for move in replayGame(game, BitboardState)]
+                except ValueError:
+                    continue
+                out.write(' '.join(moves + [game["result"]]) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import time
+from ChessEngine import GameState, MoveCache
+from Bitboard import BitboardState
+
+# Standard perft test positions. Expected leaf counts follow the engine's rules, which always promote to a queen,
+# so positions where underpromotion changes the tree use counts for queen-only promotion
+POSITIONS = {
+    "start": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "kiwipete": "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "endgame": "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "mirror": "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+    "talkchess": "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+    "middlegame": "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+}
+
+BASELINES = {
+    "start": [20, 400, 8902, 197281, 4865609],
+    "kiwipete": [48, 2039, 97862, 4074224],
+    "endgame": [14, 191, 2812, 43238, 674624],
+    "mirror": [6, 228, 8087, 320802],
+    "talkchess": [41, 1373, 54007, 1806790],
+    "middlegame": [46, 2079, 89890, 3894594],
+}
+
+def perft(state, depth):
+    if depth == 0:
+        return 1
+    moves = state.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        state.makeMove(move)
+        nodes += perft(state, depth - 1)
+        state.undoMove()
+    return nodes
+
+
+# Per root move leaf counts, the usual way to find which branch of the tree a move generation bug lives in
+def divide(state, depth):
+    counts = {}
+    for move in state.getValidMoves():
+        state.makeMove(move)
+        counts[move.getNotation()] = perft(state, depth - 1)
+        state.undoMove()
+    return counts
+
+
+# Runs perft on a position and returns (nodes, seconds, nodes per second)
+def timedPerft(fen, depth, stateClass=GameState):
+    state = stateClass(fen)
+    start = time.perf_counter()
+    nodes = perft(state, depth)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed, nodes / elapsed if elapsed > 0 else 0.0
+
+
+# Checks every position against its baseline up to maxDepth, returns the list of mismatches
+def runSuite(maxDepth=3, names=None, stateClass=GameState, verbose=True):
+    failures = []
+    totalNodes = 0
+    totalTime = 0.0
+    for name in names or POSITIONS:
+        for depth, expected in enumerate(BASELINES[name][:maxDepth], 1):
+            nodes, elapsed, nps = timedPerft(POSITIONS[name], depth, stateClass)
+            totalNodes += nodes
+            totalTime += elapsed
+            ok = nodes == expected
+            if not ok:
+                failures.append((name, depth, nodes, expected))
+            if verbose:
+                print("%-11s depth %d  nodes %9d  expected %9d  %6.2fs  %8.0f nps  %s" %
+                      (name, depth, nodes, expected, elapsed, nps, "ok" if ok else "FAIL"))
+    if verbose:
+        print("total %d nodes in %.2fs, %.0f nps, %d failures" %
+              (totalNodes, totalTime, totalNodes / totalTime if totalTime > 0 else 0.0, len(failures)))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft move generation benchmark")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--position", choices=sorted(POSITIONS), help="run a single named position")
+    parser.add_argument("--fen", help="run an arbitrary position instead of the suite")
+    parser.add_argument("--divide", action="store_true", help="print per root move counts")
+    parser.add_argument("--bitboard", action="store_true", help="use the bitboard backend")
+    parser.add_argument("--check-zobrist", action="store_true",
+                        help="verify the incremental Zobrist key against a full recomputation after every move")
+    parser.add_argument("--check-eval", action="store_true",
+                        help="verify the incremental evaluation terms the same way")
+    parser.add_argument("--move-cache", type=int, metavar="ENTRIES",
+                        help="serve move lists from a legal move cache of this many entries")
+    args = parser.parse_args()
+    stateClass = BitboardState if args.bitboard else GameState
+    stateClass.debugZobrist = args.check_zobrist
+    stateClass.debugEvaluation = args.check_eval
+    if args.move_cache:
+        stateClass.moveCache = MoveCache(args.move_cache)
+
+    if args.fen or args.divide:
+        fen = args.fen or POSITIONS[args.position or "start"]
+        state = stateClass(fen)
+        if args.divide:
+            counts = divide(state, args.depth)
+            for notation in sorted(counts):
+                print("%s: %d" % (notation, counts[notation]))
+            print("moves %d  nodes %d" % (len(counts), sum(counts.values())))
+        else:
+            nodes, elapsed, nps = timedPerft(fen, args.depth, stateClass)
+            print("depth %d  nodes %d  %.2fs  %.0f nps" % (args.depth, nodes, elapsed, nps))
+        return
+    failures = runSuite(args.depth, [args.position] if args.position else None, stateClass)
+    if args.move_cache:
+        print("move cache: %(entries)d entries, %(hits)d hits, %(misses)d misses, %(evictions)d evictions" %
+              stateClass.moveCache.stats())
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
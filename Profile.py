@@ -0,0 +1,242 @@
+import argparse
+import cProfile
+import functools
+import inspect
+import json
+import platform
+import pstats
+import subprocess
+import time
+import tracemalloc
+import ChessEngine
+import Bitboard
+from ChessEngine import GameState
+from Bitboard import BitboardState
+from AI import AlphaBetaBot, TranspositionTable
+from Perft import POSITIONS, perft
+
+# Opt-in instrumentation of the engine's hot paths. Nothing in the engine refers to this module: Counters swaps the
+# listed methods for counting wrappers when its with block starts and puts the originals back when it ends, so with
+# profiling off the engine runs exactly the code it always does. Every wrapped function gets its call count, its
+# cumulative time (recursive calls counted once) and the Move objects created while it was the innermost wrapped
+# function; the categories split the time between move generation, make/unmake and evaluation. The cprofile and
+# tracemalloc modes run the same workload under those tools instead.
+#   python Profile.py report --out profile.json
+#   python Profile.py report --mode tracemalloc --bitboard --out memory.json
+#   python Profile.py compare old.json profile.json
+
+HOT_PATHS = {
+    GameState: ['getValidMoves', 'generateValidMoves', 'getStagedMoves', 'getTacticalMoves', 'getPossibleMoves',
+                'getEvasionMoves', 'getCaptureMoves', 'pinsAndChecks', 'squareUnderAttack', 'isAttacked',
+                'getPawnMoves', 'getKnightMoves', 'getBishopMoves', 'getRookMoves', 'getQueenMoves', 'getKingMoves',
+                'getCastleMoves', 'makeMove', 'undoMove', 'evaluation', 'see'],
+    BitboardState: ['getValidMoves', 'generateValidMoves', 'getStagedMoves', 'getTacticalMoves', 'getPawnMoves',
+                    'getCastleMoves', 'attackersTo', 'isAttacked', 'makeMove', 'undoMove', 'evaluation', 'see'],
+    AlphaBetaBot: ['search', 'negamax', 'quiescenceSearch', 'evaluate'],
+    TranspositionTable: ['probe', 'store'],
+}
+CATEGORIES = {
+    "generation": ['getValidMoves', 'generateValidMoves', 'getStagedMoves', 'getTacticalMoves'],
+    "makeUnmake": ['makeMove', 'undoMove'],
+    "evaluation": ['evaluation', 'see'],
+}
+
+
+class Counters:
+    def __init__(self, hotPaths=HOT_PATHS):
+        self.hotPaths = hotPaths
+        self.functions = {}
+        self.categories = {name: {"seconds": 0.0, "active": 0} for name in CATEGORIES}
+        self.stack = []  # stats of the wrapped calls in progress, innermost last
+        self.moveAllocations = 0
+        self.originals = []
+
+    def __enter__(self):
+        for owner, names in self.hotPaths.items():
+            for name in names:
+                if name in owner.__dict__:
+                    self.patch(owner, name, self.wrap(owner.__name__ + '.' + name, name, owner.__dict__[name]))
+        self.patch(ChessEngine.Move, '__init__', self.countMoves(ChessEngine.Move.__init__))
+        self.patch(Bitboard, 'newMove', self.countMoves(Bitboard.newMove))
+        return self
+
+    def __exit__(self, *exception):
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+
+    def patch(self, owner, name, replacement):
+        self.originals.append((owner, name, owner.__dict__[name]))
+        setattr(owner, name, replacement)
+
+    def wrap(self, key, name, function):
+        stats = self.functions.setdefault(key, {"calls": 0, "seconds": 0.0, "moveAllocations": 0, "active": 0})
+        category = next((self.categories[c] for c, names in CATEGORIES.items() if name in names), None)
+        stack = self.stack
+        clock = time.perf_counter
+
+        def enter():
+            stats["active"] += 1
+            if category is not None:
+                category["active"] += 1
+            stack.append(stats)
+            return clock()
+
+        def leave(start):
+            elapsed = clock() - start
+            stack.pop()
+            stats["active"] -= 1
+            if stats["active"] == 0:
+                stats["seconds"] += elapsed
+            if category is not None:
+                category["active"] -= 1
+                if category["active"] == 0:
+                    category["seconds"] += elapsed
+
+        if inspect.isgeneratorfunction(function):
+            # Only the time spent producing items is counted, not the caller's time between them
+            @functools.wraps(function)
+            def countedGenerator(*args, **kwargs):
+                iterator = function(*args, **kwargs)
+                stats["calls"] += 1
+                while True:
+                    start = enter()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        leave(start)
+                    yield item
+            return countedGenerator
+
+        @functools.wraps(function)
+        def counted(*args, **kwargs):
+            stats["calls"] += 1
+            start = enter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                leave(start)
+        return counted
+
+    def countMoves(self, function):
+        @functools.wraps(function)
+        def counted(*args, **kwargs):
+            self.moveAllocations += 1
+            if self.stack:
+                self.stack[-1]["moveAllocations"] += 1
+            return function(*args, **kwargs)
+        return counted
+
+    def report(self):
+        functions = {key: {name: value for name, value in stats.items() if name != "active"}
+                     for key, stats in sorted(self.functions.items(), key=lambda item: -item[1]["seconds"])
+                     if stats["calls"]}
+        return {"functions": functions, "moveAllocations": self.moveAllocations,
+                "categories": {name: category["seconds"] for name, category in self.categories.items()}}
+
+
+# The standard workload: perft to perftDepth and a fixed depth search on every position of the perft suite
+def workload(stateClass=GameState, perftDepth=3, searchDepth=3):
+    for name, fen in POSITIONS.items():
+        perft(stateClass(fen), perftDepth)
+        AlphaBetaBot(maxDepth=searchDepth, timeLimit=None).search(stateClass(fen))
+
+
+def profileReport(profile, limit):
+    stats = pstats.Stats(profile).stats
+    rows = sorted(stats.items(), key=lambda item: -item[1][3])[:limit]
+    return {"functions": [{"function": "%s:%d(%s)" % key, "calls": calls, "primitiveCalls": primitive,
+                           "seconds": total, "cumulative": cumulative}
+                          for key, (primitive, calls, total, cumulative, callers) in rows]}
+
+
+def memoryReport(snapshot, peak, limit):
+    return {"peakBytes": peak, "allocations": [{"location": "%s:%d" % (stat.traceback[0].filename,
+                                                                      stat.traceback[0].lineno),
+                                                "bytes": stat.size, "count": stat.count}
+                                               for stat in snapshot.statistics('lineno')[:limit]]}
+
+
+def version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Runs the workload in the given mode and returns the report as a dict
+def runReport(mode="counters", stateClass=GameState, perftDepth=3, searchDepth=3, limit=40):
+    start = time.perf_counter()
+    if mode == "counters":
+        with Counters() as counters:
+            workload(stateClass, perftDepth, searchDepth)
+        results = counters.report()
+    elif mode == "cprofile":
+        profile = cProfile.Profile()
+        profile.runcall(workload, stateClass, perftDepth, searchDepth)
+        results = profileReport(profile, limit)
+    else:
+        tracemalloc.start()
+        workload(stateClass, perftDepth, searchDepth)
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results = memoryReport(snapshot, peak, limit)
+    return dict({"version": version(), "python": platform.python_version(), "backend": stateClass.__name__,
+                 "mode": mode, "perftDepth": perftDepth, "searchDepth": searchDepth,
+                 "positions": list(POSITIONS), "seconds": time.perf_counter() - start}, **results)
+
+
+def printCounters(report):
+    print("%-38s %10s %9s %9s" % ("function", "calls", "seconds", "moves"))
+    for key, stats in report["functions"].items():
+        print("%-38s %10d %9.3f %9d" % (key, stats["calls"], stats["seconds"], stats["moveAllocations"]))
+    print("time by category: " + ", ".join("%s %.3fs" % item for item in report["categories"].items()))
+    print("%d Move objects created" % report["moveAllocations"])
+
+
+# Calls and time per function of two counter reports side by side
+def compare(old, new):
+    print("%-38s %10s %10s %9s %9s %8s" % ("function", "old calls", "new calls", "old s", "new s", "change"))
+    for key in list(new["functions"]) + [key for key in old["functions"] if key not in new["functions"]]:
+        before = old["functions"].get(key, {"calls": 0, "seconds": 0.0})
+        after = new["functions"].get(key, {"calls": 0, "seconds": 0.0})
+        change = "%+7.1f%%" % (100 * (after["seconds"] / before["seconds"] - 1)) if before["seconds"] else "new"
+        print("%-38s %10d %10d %9.3f %9.3f %8s" % (key, before["calls"], after["calls"], before["seconds"],
+                                                    after["seconds"], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the engine over the perft positions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report = commands.add_parser("report", help="run the standard workload and write a JSON report")
+    report.add_argument("--mode", choices=["counters", "cprofile", "tracemalloc"], default="counters")
+    report.add_argument("--bitboard", action="store_true", help="use the bitboard backend")
+    report.add_argument("--perft-depth", type=int, default=3)
+    report.add_argument("--search-depth", type=int, default=3)
+    report.add_argument("--limit", type=int, default=40, help="rows kept by the cprofile and tracemalloc modes")
+    report.add_argument("--out", help="JSON file to write")
+    comparison = commands.add_parser("compare", help="compare two counter reports")
+    comparison.add_argument("old")
+    comparison.add_argument("new")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.old) as old, open(args.new) as new:
+            compare(json.load(old), json.load(new))
+        return
+    results = runReport(args.mode, BitboardState if args.bitboard else GameState, args.perft_depth,
+                        args.search_depth, args.limit)
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(results, out, indent=1)
+    if args.mode == "counters":
+        printCounters(results)
+    print("%s workload in %.1fs%s" % (args.mode, results["seconds"], ", written to " + args.out if args.out else ""))
+
+
+if __name__ == '__main__':
+    main()
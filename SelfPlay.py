@@ -0,0 +1,146 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import struct
+import time
+from ChessEngine import MoveCache
+from Tournament import BACKENDS, makeBot, insufficientMaterial
+
+# Self-play training data. Bots play each other in a process pool and every searched position is stored as a fixed
+# size record: the position snapshot (toBytes), the game result and the search score from the side to move's point of
+# view, and the code of the move that was played. Records go into shard files of at most shardSize records each, listed
+# with their counts in index.json. Dataset.py reads them back.
+#   python SelfPlay.py --games 1000 --out data --bot alphabeta:maxDepth=3,timeLimit=None
+
+RECORD = struct.Struct('<69sbhH')
+MAX_SCORE = 32767  # mate scores are clamped into the int16 field
+
+
+def clampScore(score):
+    return max(-MAX_SCORE, min(MAX_SCORE, score))
+
+
+# Plays one game and returns (result, records) with result "1-0", "0-1" or "1/2-1/2". The first randomPlies moves are
+# random (so games differ) and not recorded.
+def playGame(game):
+    rng = random.Random(game["seed"])
+    random.seed(game["seed"])
+    state = BACKENDS[game["backend"]]()
+    state.moveCache = MoveCache(10000)  # repeated positions come back out of the cache
+    bot = makeBot(game["bot"])
+    positions = []  # (snapshot, white to move, score, move code)
+    seen = {state.zobristKey: 1}
+    quietPlies = 0
+    result = "1/2-1/2"
+    for ply in range(game["maxPlies"]):
+        moves = state.getValidMoves()
+        if len(moves) == 0:
+            if state.inCheck:
+                result = "0-1" if state.whiteMoves else "1-0"
+            break
+        if ply < game["randomPlies"]:
+            move = rng.choice(moves)
+        else:
+            move, score = bot.search(state, moves)
+            positions.append((state.toBytes(), state.whiteMoves, score, move.code))
+        state.makeMove(move)
+        quietPlies = 0 if move.pieceMoved[1] == 'P' or move.pieceCaptured != '--' else quietPlies + 1
+        seen[state.zobristKey] = seen.get(state.zobristKey, 0) + 1
+        if seen[state.zobristKey] >= 3 or quietPlies >= 100 or insufficientMaterial(state.pieceCounts):
+            break
+    white = {"1-0": 1, "0-1": -1, "1/2-1/2": 0}[result]
+    records = b''.join(RECORD.pack(snapshot, white if whiteMoves else -white, clampScore(score), code)
+                       for snapshot, whiteMoves, score, code in positions)
+    return result, records
+
+
+class ShardWriter:
+    def __init__(self, directory, shardSize):
+        self.directory = directory
+        self.shardSize = shardSize
+        os.makedirs(directory, exist_ok=True)
+        self.indexPath = os.path.join(directory, "index.json")
+        if os.path.exists(self.indexPath):
+            with open(self.indexPath) as file:
+                self.index = json.load(file)
+        else:
+            self.index = {"recordFormat": RECORD.format, "recordSize": RECORD.size, "shards": []}
+        self.file = None
+        self.count = 0
+
+    def write(self, records):
+        for offset in range(0, len(records), RECORD.size):
+            if self.file is None:
+                name = "shard-%05d.bin" % len(self.index["shards"])
+                self.index["shards"].append({"file": name, "records": 0})
+                self.file = open(os.path.join(self.directory, name), 'wb')
+                self.count = 0
+            self.file.write(records[offset:offset + RECORD.size])
+            self.count += 1
+            if self.count == self.shardSize:
+                self.closeShard()
+
+    def closeShard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.index["shards"][-1]["records"] = self.count
+            self.saveIndex()
+
+    # Written to a temporary file first so a reader never sees a half written index
+    def saveIndex(self):
+        temporary = self.indexPath + ".tmp"
+        with open(temporary, 'w') as file:
+            json.dump(self.index, file, indent=1)
+        os.replace(temporary, self.indexPath)
+
+    def close(self):
+        self.closeShard()
+
+
+def generate(out, games, bot="alphabeta:maxDepth=3,timeLimit=None", workers=None, shardSize=100000, seed=0,
+             randomPlies=8, maxPlies=300, backend="bitboard", verbose=True):
+    tasks = [{"seed": seed + i, "bot": bot, "randomPlies": randomPlies, "maxPlies": maxPlies, "backend": backend}
+             for i in range(games)]
+    writer = ShardWriter(out, shardSize)
+    results = {"1-0": 0, "0-1": 0, "1/2-1/2": 0}
+    positions = 0
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Pool(workers or os.cpu_count()) as pool:
+            for played, (result, records) in enumerate(pool.imap_unordered(playGame, tasks), 1):
+                writer.write(records)
+                results[result] += 1
+                positions += len(records) // RECORD.size
+                if verbose and (played % 10 == 0 or played == games):
+                    elapsed = time.perf_counter() - start
+                    print("%d/%d games, %d positions, %.0f positions/s" % (played, games, positions,
+                                                                          positions / elapsed if elapsed else 0))
+    finally:
+        writer.close()
+    return results, positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate self-play training data")
+    parser.add_argument("--out", required=True, help="dataset directory, added to if it exists")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--bot", default="alphabeta:maxDepth=3,timeLimit=None", help="bot spec as in Tournament.py")
+    parser.add_argument("--workers", type=int, help="processes to use, all cores by default")
+    parser.add_argument("--shard-size", type=int, default=100000, help="records per shard file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--random-plies", type=int, default=8, help="unrecorded random opening moves")
+    parser.add_argument("--max-plies", type=int, default=300, help="adjudicate a draw after this many plies")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="bitboard")
+    args = parser.parse_args()
+
+    results, positions = generate(args.out, args.games, args.bot, args.workers, args.shard_size, args.seed,
+                                  args.random_plies, args.max_plies, args.backend)
+    print("%d positions from %d games (+%d =%d -%d)" % (positions, args.games, results["1-0"], results["1/2-1/2"],
+                                                         results["0-1"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+import argparse
+import mmap
+import os
+import struct
+import time
+from array import array
+from ChessEngine import packSnapshot, castlingIndex
+from Bitboard import BitboardState, KNIGHT_ATTACKS, KING_ATTACKS, rookAttacks, bishopAttacks
+
+# Endgame tablebases for small piece sets, e.g. KQvK, KRvK, KPvK. Every position of a material balance gets one byte:
+# 0 for a draw, 1-127 for a win with mate in that many moves for the side to move, 128 + n for being mated in n moves
+# and 255 for positions that can't occur. Positions are indexed by side to move, the white king (mirrored onto files
+# a-d, which halves the table) and the squares of the other pieces in the order of the material key. Tables assume no
+# castling rights and no en passant capture, probes of positions with either return None.
+#   python Tablebase.py generate KQvK KRvK KPvK
+#   python Tablebase.py probe --fen "8/8/8/4k3/8/8/3QK3/8 w - - 0 1"
+#   python Tablebase.py check
+
+WIN, DRAW, LOSS = 1, 0, -1
+PIECE_ORDER = 'KQRBNP'
+HEADER = struct.Struct('4s12s')
+MAGIC = b'CTB1'
+INVALID = 255
+UNKNOWN, WON, LOST, FINAL = 0, 1, 2, 3  # generation status of a position
+
+
+def sidePart(pieces, color):
+    return ''.join(sorted((piece[1] for piece in pieces if piece[0] == color), key=PIECE_ORDER.index))
+
+
+def strength(part):
+    return len(part), [-PIECE_ORDER.index(piece) for piece in part]
+
+
+# Name of a material balance with the stronger side as white, and whether the colors had to be swapped for it
+def materialKey(pieces):
+    white, black = sidePart(pieces, 'w'), sidePart(pieces, 'b')
+    if strength(black) > strength(white):
+        return black + 'v' + white, True
+    return white + 'v' + black, False
+
+
+# 'KQvK' -> ['wK', 'wQ', 'bK'], the order squares are given in for positionIndex
+def keyPieces(key):
+    white, black = key.split('v')
+    return ['w' + piece for piece in white] + ['b' + piece for piece in black]
+
+
+def tableSize(pieces):
+    return 2 * 32 * 64 ** (pieces - 1)
+
+
+def positionIndex(squares, whiteMoves):
+    if squares[0] & 7 > 3:
+        squares = [sq ^ 7 for sq in squares]
+    index = (0 if whiteMoves else 1) * 32 + (squares[0] >> 3) * 4 + (squares[0] & 7)
+    for sq in squares[1:]:
+        index = index * 64 + sq
+    return index
+
+
+def decodeIndex(index, pieces):
+    squares = []
+    for _ in range(pieces - 1):
+        index, sq = divmod(index, 64)
+        squares.append(sq)
+    side, king = divmod(index, 32)
+    squares.append((king >> 2) * 8 + (king & 3))
+    squares.reverse()
+    return squares, side == 0
+
+
+def encodeValue(result, plies):
+    if result == WIN:
+        return (plies + 1) // 2
+    if result == LOSS:
+        return 128 + plies // 2
+    return 0
+
+
+# (result, plies to mate) for a stored byte
+def decodeValue(byte):
+    if byte == 0:
+        return DRAW, 0
+    if byte < 128:
+        return WIN, byte * 2 - 1
+    return LOSS, (byte - 128) * 2
+
+
+# The balances a capture or a promotion (always to a queen, like the engine) can turn this one into
+def subKeys(key):
+    pieces = keyPieces(key)
+    found = set()
+    for i, piece in enumerate(pieces):
+        if piece[1] == 'K':
+            continue
+        found.add(materialKey(pieces[:i] + pieces[i + 1:])[0])
+        if piece[1] == 'P':
+            found.add(materialKey(pieces[:i] + [piece[0] + 'Q'] + pieces[i + 1:])[0])
+    return sorted(found - {'KvK'}, key=len)
+
+
+class Tablebases:
+    def __init__(self, directory="tablebases", maxPieces=4):
+        self.directory = directory
+        self.maxPieces = maxPieces
+        self.tables = {}
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.ctb')
+
+    # The memory mapped table of a balance, or None when it hasn't been generated
+    def table(self, key):
+        if key not in self.tables:
+            self.tables[key] = None
+            if os.path.exists(self.path(key)):
+                with open(self.path(key), 'rb') as file:
+                    data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                if HEADER.unpack_from(data)[0] != MAGIC:
+                    raise ValueError("%s is not a tablebase file" % self.path(key))
+                self.tables[key] = data
+        return self.tables[key]
+
+    # (result, plies to mate) from the side to move's point of view for pieces given as (piece, square) pairs, or
+    # None when there is no table for them
+    def probeSquares(self, placed, whiteMoves):
+        key, flipped = materialKey([piece for piece, sq in placed])
+        if key == 'KvK':
+            return DRAW, 0
+        data = self.table(key)
+        if data is None:
+            return None
+        if flipped:
+            placed = [(('b' if piece[0] == 'w' else 'w') + piece[1], sq ^ 56) for piece, sq in placed]
+            whiteMoves = not whiteMoves
+        remaining = list(placed)
+        squares = []
+        for piece in keyPieces(key):
+            match = next(entry for entry in remaining if entry[0] == piece)
+            remaining.remove(match)
+            squares.append(match[1])
+        byte = data[HEADER.size + positionIndex(squares, whiteMoves)]
+        return None if byte == INVALID else decodeValue(byte)
+
+    def probe(self, state):
+        if sum(state.pieceCounts.values()) > self.maxPieces or castlingIndex(state.currentCastling):
+            return None
+        if state.enpassant != ():
+            row, col = state.enpassant
+            row += 1 if state.whiteMoves else -1
+            pawn = ('w' if state.whiteMoves else 'b') + 'P'
+            if any(0 <= col + j <= 7 and state.board[row][col + j] == pawn for j in (-1, 1)):
+                return None
+        placed = [(piece, x * 8 + y) for x, row in enumerate(state.board) for y, piece in enumerate(row)
+                  if piece != '--']
+        return self.probeSquares(placed, state.whiteMoves)
+
+    def close(self):
+        for data in self.tables.values():
+            if data is not None:
+                data.close()
+        self.tables = {}
+
+
+# The squares a piece on sq can have come from with a quiet move, as a bitboard: its moves read backwards onto empty
+# squares, pawns one step back (two from their fourth row) and never from the first or last row
+def unmoveOrigins(piece, sq, occupied):
+    kind = piece[1]
+    if kind == 'P':
+        step, startRow = (8, 6) if piece[0] == 'w' else (-8, 1)
+        origin = sq + step
+        if not 0 < origin // 8 < 7 or occupied >> origin & 1:
+            return 0
+        if (origin + step) // 8 == startRow and not occupied >> (origin + step) & 1:
+            return 1 << origin | 1 << (origin + step)
+        return 1 << origin
+    if kind == 'N':
+        attacks = KNIGHT_ATTACKS[sq]
+    elif kind == 'K':
+        attacks = KING_ATTACKS[sq]
+    else:
+        attacks = 0
+        if kind in 'RQ':
+            attacks |= rookAttacks(sq, occupied)
+        if kind in 'BQ':
+            attacks |= bishopAttacks(sq, occupied)
+    return attacks & ~occupied
+
+
+# The distinct positions of a table one quiet move before position index, found by un-moving each piece of the side
+# that just moved. Captures and promotions lead into other tables, so nothing is ever uncaptured or unpromoted.
+def parentIndices(index, pieces):
+    squares, whiteMoves = decodeIndex(index, len(pieces))
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    mover = 'b' if whiteMoves else 'w'
+    parents = set()
+    for i, piece in enumerate(pieces):
+        if piece[0] != mover:
+            continue
+        origins = unmoveOrigins(piece, squares[i], occupied)
+        while origins:
+            lsb = origins & -origins
+            origins ^= lsb
+            parent = squares[:]
+            parent[i] = lsb.bit_length() - 1
+            parents.add(positionIndex(parent, not whiteMoves))
+    return parents
+
+
+# Resolves results backwards from the mates, one ply at a time, without storing any moves. status and plies come in
+# with the mates (LOST at ply 0) and the positions that can't occur or have no moves (FINAL), unresolved[i] counts the
+# moves of position i that don't lead to a win for the opponent yet: quiet moves to distinct positions of this table,
+# plus captures and promotions into a draw or a loss. losses[i] is the earliest ply position i can be lost at given its
+# captures into longer wins for the opponent, and seeds maps a ply to the positions captures or promotions resolve at
+# it. A position lost at ply n makes every parent (parents(i)) won at n + 1, a position won at n takes one off each
+# parent's count and a parent left at 0 is lost at n + 1, or at losses[i] when that is later. Whatever is left UNKNOWN
+# is a draw.
+def retrograde(status, plies, unresolved, losses, seeds, parents):
+    frontier = array('L', (index for index in range(len(status)) if status[index] == LOST))
+    ply = 0
+    while frontier or seeds:
+        found = array('L')
+        for index in frontier:
+            for parent in parents(index):
+                if status[parent] != UNKNOWN:
+                    continue
+                if ply % 2 == 0:
+                    status[parent] = WON
+                    plies[parent] = ply + 1
+                    found.append(parent)
+                    continue
+                unresolved[parent] -= 1
+                if unresolved[parent]:
+                    continue
+                if losses[parent] > ply + 1:
+                    seeds.setdefault(losses[parent], array('L')).append(parent)
+                else:
+                    status[parent] = LOST
+                    plies[parent] = ply + 1
+                    found.append(parent)
+        ply += 1
+        for index in seeds.pop(ply, ()):
+            if status[index] == UNKNOWN:
+                status[index] = WON if ply % 2 else LOST
+                plies[index] = ply
+                found.append(index)
+        frontier = found
+
+
+# Builds the table for a balance, first generating any smaller table it depends on. A forward pass generates each
+# position's legal moves once with the engine's rules, but only keeps counts: its distinct quiet children and its
+# captures and promotions, which are looked up in the smaller tables. retrograde then reaches parents by un-moves, so
+# memory stays at a few bytes per position: KQvKR, 16.7 million positions, peaks at about 110MB. Being plain Python,
+# a 3 piece table takes about 20 seconds and a 4 piece one about 25 minutes.
+def generate(key, directory="tablebases", verbose=True):
+    key = materialKey(keyPieces(key))[0]
+    os.makedirs(directory, exist_ok=True)
+    tablebases = Tablebases(directory, maxPieces=64)
+    for sub in subKeys(key):
+        if tablebases.table(sub) is None:
+            generate(sub, directory, verbose)
+            tablebases.tables.pop(sub)
+    start = time.perf_counter()
+    pieces = keyPieces(key)
+    size = tableSize(len(pieces))
+    status = bytearray(size)
+    plies = bytearray(size)
+    unresolved = bytearray(size)
+    losses = bytearray(size)
+    seeds = {}
+    state = BitboardState()
+    for index in range(size):
+        squares, whiteMoves = decodeIndex(index, len(pieces))
+        if len(set(squares)) < len(squares) or \
+                any(piece[1] == 'P' and sq // 8 in (0, 7) for piece, sq in zip(pieces, squares)):
+            status[index] = FINAL
+            plies[index] = INVALID
+            continue
+        board = ['--'] * 64
+        for piece, sq in zip(pieces, squares):
+            board[sq] = piece
+        state.loadBytes(packSnapshot(board, whiteMoves, 0, -1, 0, 1))
+        them = 1 if whiteMoves else 0
+        if state.isAttacked(squares[pieces.index('bK' if whiteMoves else 'wK')], 1 - them,
+                            state.occupancy[0] | state.occupancy[1]):
+            status[index] = FINAL
+            plies[index] = INVALID
+            continue
+        moves = state.getValidMoves()
+        if len(moves) == 0:
+            status[index] = LOST if state.inCheck else FINAL
+            continue
+        children = set()
+        win = None
+        for move in moves:
+            startSq = move.startR * 8 + move.startC
+            endSq = move.endR * 8 + move.endC
+            moved = squares.index(startSq)
+            if move.pieceCaptured != '--' or move.isPawnPromotion:
+                placed = [(piece, sq) for i, (piece, sq) in enumerate(zip(pieces, squares))
+                          if i != moved and sq != endSq]
+                placed.append((pieces[moved][0] + 'Q' if move.isPawnPromotion else pieces[moved], endSq))
+                result, childPlies = tablebases.probeSquares(placed, not whiteMoves)
+                if result == WIN:
+                    losses[index] = max(losses[index], childPlies + 1)
+                    continue
+                unresolved[index] += 1
+                if result == LOSS and (win is None or childPlies + 1 < win):
+                    win = childPlies + 1
+            else:
+                child = squares[:]
+                child[moved] = endSq
+                children.add(positionIndex(child, not whiteMoves))
+        unresolved[index] += len(children)
+        if win is not None:
+            seeds.setdefault(win, array('L')).append(index)
+        elif unresolved[index] == 0:
+            seeds.setdefault(losses[index], array('L')).append(index)
+    if verbose:
+        print("%s: %d positions counted in %.1fs" % (key, size, time.perf_counter() - start))
+
+    retrograde(status, plies, unresolved, losses, seeds, lambda index: parentIndices(index, pieces))
+
+    table = bytearray(size)
+    longest = 0
+    for index in range(size):
+        if status[index] == WON:
+            table[index] = encodeValue(WIN, plies[index])
+        elif status[index] == LOST:
+            table[index] = encodeValue(LOSS, plies[index])
+        elif plies[index] == INVALID:
+            table[index] = INVALID
+            continue
+        else:
+            continue
+        longest = max(longest, plies[index])
+    with open(tablebases.path(key), 'wb') as file:
+        file.write(HEADER.pack(MAGIC, key.encode()))
+        file.write(table)
+    if verbose:
+        wins, lost = status.count(WON), status.count(LOST)
+        print("%s: %d wins, %d losses, %d draws, longest mate %d plies, %.1fs" %
+              (key, wins, lost, size - wins - lost - table.count(INVALID), longest, time.perf_counter() - start))
+
+
+# Known results: (fen, result, plies to mate or None when only the result is checked)
+KNOWN = [
+    ("7k/8/6K1/8/8/8/8/1Q6 w - - 0 1", WIN, 1),
+    ("7k/1Q6/6K1/8/8/8/8/8 b - - 0 1", LOSS, 2),
+    ("4k3/4P3/4K3/8/8/8/8/8 b - - 0 1", DRAW, 0),  # stalemate
+    ("8/8/8/8/8/3k4/3P4/7K b - - 0 1", DRAW, 0),  # Kxd2
+    ("8/P7/8/8/8/8/8/K6k w - - 0 1", WIN, None),
+]
+LONGEST = {"KQvK": 19}  # plies of the longest mate
+
+
+# A small graph with captures into longer mates than this table's own: position 0 mates at once by a capture, position 1
+# can go to 0 or capture into a position won in 7 plies, so it lasts 8, and position 2 wins in 9 by moving to 1
+def checkRetrograde():
+    status = bytearray(3)
+    plies = bytearray(3)
+    unresolved = bytearray([1, 1, 1])
+    losses = bytearray([0, 8, 0])
+    seeds = {1: array('L', [0])}
+    parents = {0: [1], 1: [2], 2: []}
+    retrograde(status, plies, unresolved, losses, seeds, parents.get)
+    return list(zip(status, plies)) == [(WON, 1), (LOST, 8), (WON, 9)]
+
+
+# Generates KQvK and KPvK when missing and checks them against KNOWN and LONGEST, returns the number of failures
+def check(directory="tablebases"):
+    failures = 0
+    ok = checkRetrograde()
+    failures += not ok
+    print("retrograde with external mates  %s" % ("ok" if ok else "FAIL"))
+    tablebases = Tablebases(directory)
+    for key in ("KQvK", "KPvK"):
+        if tablebases.table(key) is None:
+            tablebases.tables.pop(key)
+            generate(key, directory)
+    for fen, result, plies in KNOWN:
+        found = tablebases.probe(BitboardState(fen))
+        ok = found is not None and found[0] == result and (plies is None or found[1] == plies)
+        failures += not ok
+        print("%-36s %-12s %s" % (fen, found, "ok" if ok else "FAIL"))
+    for key, expected in LONGEST.items():
+        data = tablebases.table(key)
+        longest = max(decodeValue(byte)[1] for byte in data[HEADER.size:] if 0 < byte < 128)
+        ok = longest == expected
+        failures += not ok
+        print("%s longest mate %d plies, expected %d  %s" % (key, longest, expected, "ok" if ok else "FAIL"))
+    tablebases.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate or probe endgame tablebases")
+    parser.add_argument("--dir", default="tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("generate", help="generate tables (and the smaller ones they need)")
+    build.add_argument("keys", nargs="+", help="material balances such as KQvK KRvK KPvK")
+    probe = commands.add_parser("probe", help="look up a position")
+    probe.add_argument("--fen", required=True)
+    commands.add_parser("check", help="check the retrograde analysis and known KQvK and KPvK results")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        for key in args.keys:
+            generate(key, args.dir)
+    elif args.command == "check":
+        raise SystemExit(1 if check(args.dir) else 0)
+    else:
+        found = Tablebases(args.dir).probe(BitboardState(args.fen))
+        if found is None:
+            print("not in the tablebases")
+        else:
+            result, plies = found
+            print({WIN: "win", DRAW: "draw", LOSS: "loss"}[result] + (", mate in %d plies" % plies if result else ""))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from ChessEngine import GameState
+from Bitboard import BitboardState
+from AI import RandomBot, AlphaBetaBot, NNUEBot
+from Book import OpeningBook
+
+# Headless bot vs bot matches: no pygame or display needed. Games run in a process pool, every finished game is
+# written as one JSON line and a score / Elo table is printed at the end.
+#   python Tournament.py --bots random alphabeta:maxDepth=2 --games 200 --out results.jsonl
+
+BOTS = {
+    "random": lambda: RandomBot,
+    "alphabeta": AlphaBetaBot,
+    "nnue": NNUEBot,
+}
+BACKENDS = {"gamestate": GameState, "bitboard": BitboardState}
+
+
+# "alphabeta:maxDepth=3,timeLimit=0.1" -> AlphaBetaBot(maxDepth=3, timeLimit=0.1). A new bot is made for every game
+# so bots that keep state between moves (like the transposition table) start fresh.
+def makeBot(spec):
+    name, _, options = spec.partition(":")
+    kwargs = {}
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition("=")
+        kwargs[key] = parseValue(value)
+    return BOTS[name](**kwargs)
+
+
+def parseValue(value):
+    if value == "None":
+        return None
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+BOOKS = {}  # opened once per process
+
+
+def openBook(path):
+    if path not in BOOKS:
+        BOOKS[path] = OpeningBook(path)
+    return BOOKS[path]
+
+
+# Only kings, or kings and a single knight or bishop
+def insufficientMaterial(counts):
+    pieces = {piece: count for piece, count in counts.items() if count and piece[1] != 'K'}
+    return not pieces or (len(pieces) == 1 and sum(pieces.values()) == 1 and next(iter(pieces))[1] in 'NB')
+
+
+# Plays one game and returns its record. randomPlies random moves are played first so games between the same
+# deterministic bots don't all repeat each other, then moves from the book (if any) while the position is in it.
+def playGame(game):
+    rng = random.Random(game["seed"])
+    random.seed(game["seed"])
+    book = openBook(game["book"]) if game.get("book") else None
+    bookPlies = 0
+    state = BACKENDS[game["backend"]]()
+    bots = {True: makeBot(game["white"]), False: makeBot(game["black"])}
+    moves = []
+    moveTimes = []
+    seen = {state.zobristKey: 1}
+    quietPlies = 0
+    result, reason = "1/2-1/2", "max plies"
+    while len(moves) < game["maxPlies"]:
+        validMoves = state.getValidMoves()
+        if len(validMoves) == 0:
+            if state.inCheck:
+                result, reason = ("0-1" if state.whiteMoves else "1-0"), "checkmate"
+            else:
+                reason = "stalemate"
+            break
+        start = time.perf_counter()
+        move = None
+        if len(moves) < game["randomPlies"]:
+            move = rng.choice(validMoves)
+        elif book is not None and bookPlies == len(moves) - game["randomPlies"]:
+            move = book.choose(state, validMoves, rng)
+            bookPlies += move is not None
+        if move is None:
+            move = validMoves[bots[state.whiteMoves](validMoves, state)]
+        moveTimes.append(round(time.perf_counter() - start, 6))
+        state.makeMove(move)
+        moves.append(move.getNotation())
+        quietPlies = 0 if move.pieceMoved[1] == 'P' or move.pieceCaptured != '--' else quietPlies + 1
+        seen[state.zobristKey] = seen.get(state.zobristKey, 0) + 1
+        if seen[state.zobristKey] >= 3:
+            reason = "repetition"
+            break
+        if quietPlies >= 100:
+            reason = "fifty moves"
+            break
+        if insufficientMaterial(state.pieceCounts):
+            reason = "insufficient material"
+            break
+    return dict(game, result=result, reason=reason, plies=len(moves), bookPlies=bookPlies, moves=moves,
+                moveTimes=moveTimes)
+
+
+# Every pair of bots plays `games` games, alternating colors
+def schedule(specs, games, seed=0, randomPlies=4, maxPlies=300, backend="bitboard", book=None):
+    schedule = []
+    for first, second in itertools.combinations(specs, 2):
+        for i in range(games):
+            white, black = (first, second) if i % 2 == 0 else (second, first)
+            schedule.append({"game": len(schedule), "white": white, "black": black, "seed": seed + len(schedule),
+                             "randomPlies": randomPlies, "maxPlies": maxPlies, "backend": backend, "book": book})
+    return schedule
+
+
+# Runs the games on `workers` processes and streams each record to `out` as it finishes. Returns all records.
+def runTournament(games, workers=None, out=None, verbose=True):
+    results = []
+    output = open(out, "a") if out else None
+    start = time.perf_counter()
+    try:
+        with multiprocessing.Pool(workers or os.cpu_count()) as pool:
+            for record in pool.imap_unordered(playGame, games):
+                results.append(record)
+                if output:
+                    output.write(json.dumps(record) + "\n")
+                    output.flush()
+                if verbose:
+                    print("game %d  %s vs %s  %s (%s, %d plies)" %
+                          (record["game"], record["white"], record["black"], record["result"], record["reason"],
+                           record["plies"]))
+    finally:
+        if output:
+            output.close()
+    if verbose:
+        elapsed = time.perf_counter() - start
+        print("%d games in %.1fs, %.2f games/s" % (len(results), elapsed, len(results) / elapsed if elapsed else 0))
+    return results
+
+
+POINTS = {"1-0": (1.0, 0.0), "0-1": (0.0, 1.0), "1/2-1/2": (0.5, 0.5)}
+
+
+# Elo difference implied by a score fraction; perfect scores are pulled in by half a game so it stays finite
+def eloDifference(points, games):
+    score = min(max(points / games, 0.5 / games), 1 - 0.5 / games)
+    return 400 * math.log10(score / (1 - score))
+
+
+# Per bot wins / draws / losses / score and the Elo difference against the rest of the field
+def summarize(results):
+    table = {}
+    for record in results:
+        whitePoints, blackPoints = POINTS[record["result"]]
+        for spec, points in ((record["white"], whitePoints), (record["black"], blackPoints)):
+            row = table.setdefault(spec, {"games": 0, "wins": 0, "draws": 0, "losses": 0, "points": 0.0})
+            row["games"] += 1
+            row["points"] += points
+            row["wins" if points == 1 else "draws" if points == 0.5 else "losses"] += 1
+    for row in table.values():
+        row["score"] = row["points"] / row["games"]
+        row["elo"] = eloDifference(row["points"], row["games"])
+    return table
+
+
+def printSummary(table):
+    width = max([len(spec) for spec in table] + [3])
+    print("%-*s %6s %6s %6s %6s %7s %7s" % (width, "bot", "games", "wins", "draws", "losses", "score", "elo"))
+    for spec, row in sorted(table.items(), key=lambda item: -item[1]["score"]):
+        print("%-*s %6d %6d %6d %6d %6.1f%% %+7.0f" % (width, spec, row["games"], row["wins"], row["draws"],
+                                                       row["losses"], 100 * row["score"], row["elo"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless bot vs bot tournament")
+    parser.add_argument("--bots", nargs="+", default=["random", "alphabeta:maxDepth=2,timeLimit=None"],
+                        help="bot specs, name[:key=value,...] with names from " + ", ".join(sorted(BOTS)))
+    parser.add_argument("--games", type=int, default=100, help="games per pair of bots")
+    parser.add_argument("--workers", type=int, help="processes to use, all cores by default")
+    parser.add_argument("--out", help="append one JSON line per game to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--random-plies", type=int, default=4, help="random opening moves before the bots play")
+    parser.add_argument("--max-plies", type=int, default=300, help="adjudicate a draw after this many plies")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="bitboard")
+    parser.add_argument("--book", help="opening book to play from before the bots take over")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args()
+    if len(args.bots) < 2:
+        parser.error("need at least two bots")
+
+    games = schedule(args.bots, args.games, args.seed, args.random_plies, args.max_plies, args.backend, args.book)
+    results = runTournament(games, args.workers, args.out, not args.quiet)
+    printSummary(summarize(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import sys
+import threading
+from ChessEngine import GameState
+from Bitboard import BitboardState
+from AI import AlphaBetaBot, MATE, MATE_BOUND
+
+# UCI front end, so the engine can be run by chess GUIs and match tools (cutechess-cli, fastchess, ...) under real
+# time controls. Commands are read from stdin and answered on stdout. The search runs on its own thread, so stop,
+# isready and ponderhit are handled while it thinks, and every finished iteration is reported as an info line with
+# depth, score, nodes, nps and the principal variation.
+#   python UCI.py
+
+NAME = "Chess-Engine"
+AUTHOR = "Chess-Engine contributors"
+BACKENDS = {"bitboard": BitboardState, "gamestate": GameState}
+MOVE_OVERHEAD = 0.05  # seconds kept back from every time budget for the GUI's own delays
+ENTRY_BYTES = 128  # rough size of one transposition table entry, to turn the Hash option into a table size
+
+
+# Move in UCI coordinates, with the promotion piece the engine always plays
+def uciMove(move):
+    return move.getNotation() + ('q' if move.isPawnPromotion else '')
+
+
+# The legal move for a UCI string. Underpromotions can't be played by the engine and become queen promotions.
+def parseMove(state, text):
+    notation = text[:4]
+    for move in state.getValidMoves():
+        if move.getNotation() == notation:
+            return move
+    raise ValueError("illegal move %s" % text)
+
+
+def scoreText(score):
+    if score > MATE_BOUND:
+        return "mate %d" % ((MATE - score + 1) // 2)
+    if score < -MATE_BOUND:
+        return "mate -%d" % ((MATE + score) // 2)
+    return "cp %d" % score
+
+
+# Seconds to think on this move: all of movetime, or a share of the remaining clock plus most of the increment
+def timeBudget(options, whiteMoves):
+    if "movetime" in options:
+        return max(options["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+    left = options.get("wtime" if whiteMoves else "btime")
+    if left is None:
+        return None
+    increment = options.get("winc" if whiteMoves else "binc", 0)
+    budget = left / options.get("movestogo", 30) + increment * 0.75
+    return max(min(budget, left / 2) / 1000 - MOVE_OVERHEAD, 0.01)
+
+
+class UCIEngine:
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.lock = threading.Lock()
+        self.backend = "bitboard"
+        self.hash = 32
+        self.bot = self.newBot()
+        self.state = BACKENDS[self.backend]()
+        self.thread = None
+        self.released = threading.Event()  # set by stop or ponderhit, a ponder or infinite search waits for it
+
+    def newBot(self):
+        bot = AlphaBetaBot(tableSize=max(self.hash * 1024 * 1024 // ENTRY_BYTES, 1024))
+        bot.info = self.info
+        return bot
+
+    def send(self, line):
+        with self.lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def info(self, depth, score, seconds):
+        nodes = self.bot.nodes
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s" %
+                  (depth, scoreText(score), nodes, nodes / seconds if seconds > 0 else 0, seconds * 1000,
+                   " ".join(uciMove(move) for move in self.bot.pv)))
+
+    # Handles one line of input, returns False on quit
+    def command(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        name, arguments = tokens[0], tokens[1:]
+        if name == "uci":
+            self.send("id name " + NAME)
+            self.send("id author " + AUTHOR)
+            self.send("option name Hash type spin default 32 min 1 max 4096")
+            self.send("option name Backend type combo default bitboard var bitboard var gamestate")
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif name == "isready":
+            self.send("readyok")
+        elif name == "ucinewgame":
+            self.stop()
+            self.bot = self.newBot()
+        elif name == "setoption":
+            self.stop()
+            self.setOption(arguments)
+        elif name == "position":
+            self.stop()
+            self.setPosition(arguments)
+        elif name == "go":
+            self.stop()
+            self.go(arguments)
+        elif name == "stop":
+            self.stop()
+        elif name == "ponderhit":
+            self.bot.ponderhit()
+            self.released.set()
+        elif name == "d":
+            self.send(self.state.getFEN())
+        elif name == "quit":
+            self.stop()
+            return False
+        else:
+            self.send("info string unknown command " + name)
+        return True
+
+    def setOption(self, arguments):
+        text = " ".join(arguments)
+        name, _, value = text.partition(" value ")
+        name = name.replace("name", "", 1).strip().lower()
+        value = value.strip()
+        if name == "hash":
+            self.hash = int(value)
+            self.bot = self.newBot()
+        elif name == "backend" and value in BACKENDS:
+            self.backend = value
+            self.state = BACKENDS[value](self.state.getFEN())
+
+    def setPosition(self, arguments):
+        if arguments and arguments[0] == "fen":
+            end = arguments.index("moves") if "moves" in arguments else len(arguments)
+            state = BACKENDS[self.backend](" ".join(arguments[1:end]))
+            moves = arguments[end + 1:]
+        else:
+            state = BACKENDS[self.backend]()
+            moves = arguments[arguments.index("moves") + 1:] if "moves" in arguments else []
+        for text in moves:
+            try:
+                state.makeMove(parseMove(state, text))
+            except ValueError as error:
+                self.send("info string %s" % error)
+                break
+        self.state = state
+
+    def go(self, arguments):
+        options = {}
+        flags = set()
+        i = 0
+        while i < len(arguments):
+            if arguments[i] in ("infinite", "ponder"):
+                flags.add(arguments[i])
+                i += 1
+            elif arguments[i] == "searchmoves":
+                break
+            else:
+                options[arguments[i]] = int(arguments[i + 1]) if i + 1 < len(arguments) else 0
+                i += 2
+        bot = self.bot
+        bot.maxDepth = options.get("depth", 64)
+        bot.nodeLimit = options.get("nodes")
+        bot.timeLimit = None if "infinite" in flags else timeBudget(options, self.state.whiteMoves)
+        bot.stopRequested = False
+        bot.pondering = "ponder" in flags
+        self.released.clear()
+        self.thread = threading.Thread(target=self.search, args=(self.state.clone(), "infinite" in flags), daemon=True)
+        self.thread.start()
+
+    def search(self, state, infinite):
+        moves = state.getValidMoves()
+        if len(moves) == 0:
+            move = None
+        else:
+            move, score = self.bot.search(state, moves)
+        # UCI doesn't allow the best move before stop (or ponderhit) when searching infinitely or pondering
+        if infinite or self.bot.pondering:
+            self.released.wait()
+        if move is None:
+            self.send("bestmove 0000")
+        elif len(self.bot.pv) > 1 and self.bot.pv[0] is move:
+            self.send("bestmove %s ponder %s" % (uciMove(move), uciMove(self.bot.pv[1])))
+        else:
+            self.send("bestmove " + uciMove(move))
+
+    def stop(self):
+        if self.thread is not None:
+            self.bot.stop()
+            self.released.set()
+            self.thread.join()
+            self.thread = None
+
+
+def main():
+    engine = UCIEngine()
+    for line in sys.stdin:
+        if not engine.command(line.strip()):
+            break
+    engine.stop()
+
+
+if __name__ == '__main__':
+    main()